@@ -62,6 +62,13 @@ setup(
     namespace_packages=['z3c'],
     python_requires='>=3.7',
     extras_require=dict(
+        benchmark=[
+            'z3c.macro',
+            'zope.app.pagetemplate',
+            'zope.app.testing',
+            'zope.browserresource',
+            'zope.viewlet',
+        ],
         test=[
             'z3c.macro',
             'zope.app.pagetemplate',
@@ -70,17 +77,23 @@ setup(
             'zope.publisher',
             'zope.testing',
             'zope.testrunner',
+            'zope.viewlet',
         ],
     ),
     install_requires=[
         'setuptools',
+        'transaction >= 3.0',
         'z3c.form >= 2.0',
         'z3c.formui',
         'z3c.pagelet',
+        'z3c.template',
+        'zope.annotation',
+        'zope.authentication',
         'zope.browserpage',
         'zope.component',
         'zope.configuration',
         'zope.event',
+        'zope.i18n',
         'zope.i18nmessageid',
         'zope.interface',
         'zope.lifecycleevent',
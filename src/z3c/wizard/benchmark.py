@@ -0,0 +1,284 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Wizard benchmarks.
+
+The benchmarks use the test setup, install the ``benchmark`` extra and run
+them with::
+
+  python -m z3c.wizard.benchmark --sizes 5 50 500 --output bench.json
+
+The results get written as JSON. Each result contains the number of steps,
+the benchmarked operation and the timings in seconds. The ``configure``
+operation times the ZCML configuration of the wizard steps.
+"""
+__docformat__ = "reStructuredText"
+
+import argparse
+import json
+import platform
+import sys
+import time
+import types
+
+import z3c.form
+import z3c.form.interfaces
+import z3c.formui
+import z3c.macro
+import z3c.template
+import zope.browserresource
+import zope.component
+import zope.i18n
+import zope.interface
+import zope.publisher.browser
+import zope.schema
+import zope.security
+import zope.viewlet
+from z3c.form import field
+from z3c.formui.interfaces import IDivFormLayer
+from zope.configuration import xmlconfig
+from zope.interface.interface import InterfaceClass
+
+import z3c.wizard
+from z3c.wizard import interfaces
+from z3c.wizard import step
+from z3c.wizard import testing
+from z3c.wizard import wizard
+
+
+OPERATIONS = ('publishTraverse', 'update', 'stepMenu', 'completed', 'render',
+              'configure')
+
+
+class IBenchmarkContent(zope.interface.Interface):
+    """Benchmark content."""
+
+    firstName = zope.schema.TextLine(title='First Name')
+    lastName = zope.schema.TextLine(title='Last Name')
+
+
+@zope.interface.implementer(IBenchmarkContent)
+class BenchmarkContent:
+    """Benchmark content with completed values."""
+
+    __name__ = __parent__ = None
+    firstName = 'Roger'
+    lastName = 'Ineichen'
+
+
+class BenchmarkStep(step.EditStep):
+    """Step registered by the configure benchmark."""
+
+    fields = field.Fields(IBenchmarkContent)
+
+
+@zope.interface.implementer(z3c.form.interfaces.IFormLayer, IDivFormLayer)
+class BenchmarkRequest(zope.publisher.browser.TestRequest):
+    """Benchmark request."""
+
+
+def setUp():
+    """Set up the component registry like the README doctest does."""
+    test = types.SimpleNamespace()
+    testing.setUp(test)
+    for package in (z3c.form, z3c.macro, z3c.template, z3c.wizard,
+                    zope.browserresource, zope.component, zope.i18n,
+                    zope.security, zope.viewlet):
+        xmlconfig.XMLConfig('meta.zcml', package)()
+    for package in (z3c.form, z3c.formui, z3c.wizard):
+        xmlconfig.XMLConfig('configure.zcml', package)()
+    return test.globs['root']
+
+
+def tearDown():
+    testing.tearDown(None)
+
+
+def setUpWizard(size):
+    """Register a wizard class with the given number of steps."""
+    iface = InterfaceClass(
+        'IBenchmarkWizard%s' % size, (interfaces.IWizard,),
+        __module__=__name__)
+    wizardClass = type('BenchmarkWizard%s' % size, (wizard.Wizard,),
+                       {'label': 'Benchmark Wizard'})
+    zope.interface.classImplements(wizardClass, iface)
+    for idx in range(size):
+        stepClass = type('BenchmarkStep%s' % idx, (step.EditStep,), {
+            'label': 'Step %s' % idx,
+            'weight': idx,
+            'fields': field.Fields(IBenchmarkContent),
+        })
+        zope.component.provideAdapter(
+            stepClass, (IBenchmarkContent, None, iface),
+            interfaces.IStep, name='step%s' % idx)
+    return wizardClass
+
+
+def getWizard(wizardClass, content):
+    wiz = wizardClass(content, BenchmarkRequest())
+    wiz.__parent__ = content
+    wiz.__name__ = 'wizard'
+    return wiz
+
+
+def getTraversedStep(wizardClass, content, stepName):
+    wiz = getWizard(wizardClass, content)
+    return wiz.publishTraverse(wiz.request, stepName)
+
+
+def getUpdatedStep(wizardClass, content, stepName):
+    stepInstance = getTraversedStep(wizardClass, content, stepName)
+    stepInstance.update()
+    return stepInstance
+
+
+def getStepConfiguration(size):
+    """Return ZCML registering the given number of wizard steps.
+
+    Each step gets registered once with a distinct name, so each step gets
+    its own generated class and security checker.
+    """
+    directives = []
+    for idx in range(size):
+        directives.append(
+            '<z3c:wizardStep name="step%s" for=".IBenchmarkContent"'
+            ' class=".BenchmarkStep" wizard="z3c.wizard.wizard.Wizard"'
+            ' permission="zope.Public" />' % idx)
+    return (
+        '<configure xmlns:z3c="http://namespaces.zope.org/z3c"'
+        ' package="%s">%s</configure>' % (__name__, '\n'.join(directives)))
+
+
+def getOperation(name, wizardClass, content, stepName, size=0):
+    """Return a setup and an operation callable for the given operation."""
+    if name == 'publishTraverse':
+        def setup():
+            return getWizard(wizardClass, content)
+
+        def operation(wiz):
+            return wiz.publishTraverse(wiz.request, stepName)
+
+    elif name == 'update':
+        def setup():
+            return getTraversedStep(wizardClass, content, stepName)
+
+        def operation(stepInstance):
+            return stepInstance.update()
+
+    elif name == 'stepMenu':
+        def setup():
+            return getTraversedStep(wizardClass, content, stepName).wizard
+
+        def operation(wiz):
+            return wiz.stepMenu
+
+    elif name == 'completed':
+        def setup():
+            return getTraversedStep(wizardClass, content, stepName).wizard
+
+        def operation(wiz):
+            return wiz.completed
+
+    elif name == 'render':
+        def setup():
+            return getUpdatedStep(wizardClass, content, stepName)
+
+        def operation(stepInstance):
+            return stepInstance.render()
+
+    elif name == 'configure':
+        def setup():
+            return getStepConfiguration(size)
+
+        def operation(zcml):
+            # a new configuration context without the directive conflicts
+            # of former iterations
+            context = xmlconfig.file('meta.zcml', z3c.wizard)
+            return xmlconfig.string(zcml, context)
+
+    else:
+        raise ValueError('Unknown operation %r' % name)
+    return setup, operation
+
+
+def timeOperation(setup, operation, iterations):
+    """Return the timings of the operation in seconds.
+
+    The setup is called for each iteration and is not a part of the timing.
+    """
+    timings = []
+    for idx in range(iterations):
+        obj = setup()
+        start = time.perf_counter()
+        operation(obj)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    total = sum(timings)
+    return {
+        'iterations': iterations,
+        'total': total,
+        'mean': total / iterations,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'max': timings[-1],
+    }
+
+
+def run(sizes=(5, 50, 500), iterations=20, operations=OPERATIONS):
+    """Run the benchmarks and return the results."""
+    root = setUp()
+    try:
+        content = BenchmarkContent()
+        content.__parent__ = root
+        content.__name__ = 'content'
+        results = []
+        for size in sizes:
+            wizardClass = setUpWizard(size)
+            # traverse to the last step, it checks all previous steps
+            stepName = 'step%s' % (size - 1)
+            for name in operations:
+                setup, operation = getOperation(
+                    name, wizardClass, content, stepName, size)
+                result = {'steps': size, 'operation': name}
+                result.update(timeOperation(setup, operation, iterations))
+                results.append(result)
+    finally:
+        tearDown()
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run wizard benchmarks.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 50, 500],
+                        help='Number of wizard steps')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='Iterations per operation')
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS),
+                        choices=OPERATIONS, help='Operations to benchmark')
+    parser.add_argument('--output', help='JSON output file, default stdout')
+    options = parser.parse_args(args)
+    data = run(options.sizes, options.iterations, options.operations)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(data, f, indent=2)
+    else:
+        json.dump(data, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -22,14 +22,45 @@ from z3c.wizard import interfaces
 
 
 class WizardButtonActions(button.ButtonActions):
-    """Wizard Button Actions."""
+    """Wizard Button Actions.
+
+    The back, forward and other actions get partitioned once per update.
+    """
+
+    _partition = None
+
+    def update(self):
+        super().update()
+        self._partition = self.partitionActions()
+
+    def partitionActions(self):
+        """Return the back, forward and other actions."""
+        back = []
+        forward = []
+        other = []
+        for action in self.values():
+            if interfaces.IBackButton.providedBy(action.field):
+                back.append(action)
+            elif interfaces.INextButton.providedBy(action.field):
+                forward.append(action)
+            else:
+                other.append(action)
+        return tuple(back), tuple(forward), tuple(other)
+
+    @property
+    def partition(self):
+        if self._partition is None:
+            self._partition = self.partitionActions()
+        return self._partition
 
     @property
     def backActions(self):
-        return [action for action in self.values()
-                if interfaces.IBackButton.providedBy(action.field)]
+        return self.partition[0]
 
     @property
     def forwardActions(self):
-        return [action for action in self.values()
-                if interfaces.INextButton.providedBy(action.field)]
+        return self.partition[1]
+
+    @property
+    def otherActions(self):
+        return self.partition[2]
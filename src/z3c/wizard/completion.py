@@ -0,0 +1,80 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Completion bitmaps stored as annotation of the wizard context.
+
+The annotation maps the wizard name to a (checksum, known, completed, fields)
+tuple. The checksum identifies the step names the bit positions refer to.
+The known bitmap marks the steps with a stored completed state. The fields
+map the form and schema field names to the bitmap of the steps containing the
+field.
+"""
+__docformat__ = "reStructuredText"
+
+from zope.annotation.interfaces import IAnnotations
+
+
+ANNOTATION_KEY = 'z3c.wizard.completion'
+
+
+def queryCompletionBitmap(content, wizardName, checksum):
+    """Return the known and completed bitmaps and the fields.
+
+    Returns None if the content is not annotatable.
+    """
+    annotations = IAnnotations(content, None)
+    if annotations is None:
+        return None
+    bitmap = annotations.get(ANNOTATION_KEY, {}).get(wizardName)
+    if bitmap is None or bitmap[0] != checksum:
+        return 0, 0, {}
+    return bitmap[1:]
+
+
+def setCompletionBitmap(content, wizardName, checksum, known, completed,
+                        fields):
+    """Store the bitmaps and fields of the wizard."""
+    annotations = IAnnotations(content)
+    # store a new mapping, the annotations notice the change
+    bitmaps = dict(annotations.get(ANNOTATION_KEY, {}))
+    bitmaps[wizardName] = (checksum, known, completed, fields)
+    annotations[ANNOTATION_KEY] = bitmaps
+
+
+def updateCompletionBitmaps(event):
+    """Forget the completed states of the steps containing changed fields.
+
+    All completed states get forgotten if the event doesn't describe the
+    changed fields.
+    """
+    annotations = IAnnotations(event.object, None)
+    if annotations is None:
+        return
+    bitmaps = annotations.get(ANNOTATION_KEY)
+    if not bitmaps:
+        return
+    names = [name for description in event.descriptions
+             for name in getattr(description, 'attributes', ())]
+    changed = {}
+    for wizardName, (checksum, known, completed, fields) in bitmaps.items():
+        if names:
+            mask = 0
+            for name in names:
+                mask |= fields.get(name, 0)
+        else:
+            mask = known
+        if known & mask:
+            changed[wizardName] = (
+                checksum, known & ~mask, completed & ~mask, fields)
+    if changed:
+        annotations[ANNOTATION_KEY] = dict(bitmaps, **changed)
@@ -0,0 +1,93 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Wizard data store implementations."""
+__docformat__ = "reStructuredText"
+
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+
+import zope.interface
+
+from z3c.wizard import interfaces
+from z3c.wizard.cache import LRUCache
+
+
+@zope.interface.implementer(interfaces.IWizardDataStore)
+class MemoryDataStore:
+    """In-memory data store evicting the least recently used data.
+
+    The data only lives in the current process. Use it with sticky sessions
+    or a single process setup.
+    """
+
+    def __init__(self, size=1000):
+        self._cache = LRUCache(size)
+
+    def load(self, key):
+        """See interfaces.IWizardDataStore"""
+        return copy.deepcopy(self._cache.get(key))
+
+    def save(self, key, data):
+        """See interfaces.IWizardDataStore"""
+        self._cache.set(key, copy.deepcopy(data))
+
+    def remove(self, key):
+        """See interfaces.IWizardDataStore"""
+        self._cache.invalidate(key)
+
+
+@zope.interface.implementer(interfaces.IWizardDataStore)
+class FileDataStore:
+    """Data store using one pickle file per key in the given directory.
+
+    The directory must only be accessible by the application since the data
+    get unpickled on load.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _getPath(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.pickle')
+
+    def load(self, key):
+        """See interfaces.IWizardDataStore"""
+        try:
+            with open(self._getPath(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, data):
+        """See interfaces.IWizardDataStore"""
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, self._getPath(key))
+        except BaseException:
+            os.unlink(tmpPath)
+            raise
+
+    def remove(self, key):
+        """See interfaces.IWizardDataStore"""
+        try:
+            os.unlink(self._getPath(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,103 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Wizard funnel events.
+
+The funnel recording is disabled by default. Register an IFunnelRecorder
+utility for enable it, e.g. the FunnelRecorder keeping the events in memory::
+
+  <utility factory="z3c.wizard.funnel.FunnelRecorder" />
+
+Each event is a (timestamp, wizard name, step name, event, principal id)
+tuple. The events are 'enter' if a step gets traversed, 'next', 'back' and
+'complete' if the wizard action succeeded and 'invalid' if the step data
+are not valid.
+"""
+__docformat__ = "reStructuredText"
+
+import collections
+import json
+import threading
+import time
+
+import zope.interface
+
+from z3c.wizard import interfaces
+
+
+@zope.interface.implementer(interfaces.IFunnelSink)
+class MemorySink:
+    """Sink keeping the most recent events in memory."""
+
+    def __init__(self, size=10000):
+        self.events = collections.deque(maxlen=size)
+
+    def write(self, events):
+        """See interfaces.IFunnelSink"""
+        self.events.extend(events)
+
+
+@zope.interface.implementer(interfaces.IFunnelSink)
+class FileSink:
+    """Sink appending the events as JSON lines to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, events):
+        """See interfaces.IFunnelSink"""
+        lines = ''.join(json.dumps(event) + '\n' for event in events)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+
+
+@zope.interface.implementer(interfaces.IFunnelRecorder)
+class FunnelRecorder:
+    """Records the events in a ring buffer and flushes them to a sink.
+
+    Appending to the bounded deque needs no lock, the oldest events get
+    dropped if the buffer is full. The buffer gets flushed if it contains
+    flushSize events.
+    """
+
+    def __init__(self, sink=None, size=10000, flushSize=1000):
+        if sink is None:
+            sink = MemorySink()
+        self.sink = sink
+        self.flushSize = flushSize
+        self._buffer = collections.deque(maxlen=size)
+
+    def record(self, wizardName, stepName, event, principalId=None):
+        """See interfaces.IFunnelRecorder"""
+        buffer = self._buffer
+        buffer.append(
+            (time.time(), wizardName, stepName, event, principalId))
+        if len(buffer) >= self.flushSize:
+            self.flush()
+
+    def flush(self):
+        """See interfaces.IFunnelRecorder"""
+        buffer = self._buffer
+        events = []
+        try:
+            # only the events recorded so far, other threads keep recording
+            for idx in range(len(buffer)):
+                events.append(buffer.popleft())
+        except IndexError:
+            # flushed by another thread
+            pass
+        if events:
+            self.sink.write(events)
+        return len(events)
@@ -50,6 +50,65 @@ class IWizardButtons(zope.interface.Interface):
     zope.interface.alsoProvides(complete, (INextButton,))
 
 
+class IWizardDataStore(zope.interface.Interface):
+    """Storage for the data collected by the wizard steps.
+
+    The wizard uses a data store for stage the step data until the wizard
+    gets completed instead of changing the content in each step.
+    """
+
+    def load(key):
+        """Return the data stored under the given key or None."""
+
+    def save(key, data):
+        """Store the data under the given key."""
+
+    def remove(key):
+        """Remove the data stored under the given key."""
+
+
+class ITimingCollector(zope.interface.Interface):
+    """Collects the durations of the wizard request phases.
+
+    The wizard times its phases only if such a utility is registered.
+    """
+
+    def record(wizardName, phase, duration):
+        """Record the duration in seconds of a wizard phase."""
+
+    def report():
+        """Return the collected timings by wizard name and phase.
+
+        Each phase offers the count, total, p50 and p99 values.
+        """
+
+    def reset():
+        """Forget the collected timings."""
+
+
+class IFunnelSink(zope.interface.Interface):
+    """Stores flushed funnel events."""
+
+    def write(events):
+        """Store the sequence of funnel event tuples."""
+
+
+class IFunnelRecorder(zope.interface.Interface):
+    """Records the funnel events of the wizards.
+
+    The wizard records the events only if such a utility is registered.
+    """
+
+    def record(wizardName, stepName, event, principalId=None):
+        """Record a funnel event of a step."""
+
+    def flush():
+        """Write the recorded events to the sink.
+
+        Returns the number of written events.
+        """
+
+
 class IStep(interfaces.IForm, IPagelet):
     """An interface marking a step sub-form."""
 
@@ -83,6 +142,30 @@ class IStep(interfaces.IForm, IPagelet):
         default=False,
         required=False)
 
+    checkConcurrently = zope.schema.Bool(
+        title='Check concurrently',
+        description='Evaluate available and completed in the check executor',
+        default=False,
+        required=False)
+
+    availableCacheTTL = zope.schema.Float(
+        title='Available cache TTL',
+        description='Seconds the available value gets reused between requests',
+        required=False)
+
+    forwarded = zope.schema.Bool(
+        title='Forwarded',
+        description='Marker for a step updated as target of a forward',
+        default=False,
+        required=False)
+
+    successors = zope.interface.Attribute(
+        """(step name, condition) pairs used by wizards with useStepGraph.
+
+        A condition is None or a callable returning True for the wizard if
+        the step with the given name follows. Unavailable steps get
+        skipped.""")
+
     handleApplyOnBack = zope.schema.Bool(
         title='Handle apply changes on back',
         description='Handle apply changes on back will force validation',
@@ -125,6 +208,36 @@ class IStep(interfaces.IForm, IPagelet):
         default=True,
         required=False)
 
+    def getDataManager(content, name, field):
+        """Return the (cached) data manager for the content and form field."""
+
+    def getTargetContent():
+        """Return the content the step data get applied to.
+
+        This is the step content if the wizard doesn't stage the step data.
+        """
+
+    def queryStagedData():
+        """Return the staged data of the step or None if not staged."""
+
+    def getStagedChanges():
+        """Return the staged step data keyed by form field name."""
+
+    def dumpStagedData(data):
+        """Return the staged data as JSON serializable widget values."""
+
+    def loadStagedData(values):
+        """Return the staged data of the given widget values."""
+
+    def applyStagedData():
+        """Apply the staged step data to the target content."""
+
+    def getAvailableCacheKey():
+        """Return the key used for cache the available value."""
+
+    def getCompletedCacheKey():
+        """Return the completed state cache key or None for skip caching."""
+
     def goToStep(stepName):
         """Redirect to step by name."""
 
@@ -152,6 +265,18 @@ class IStep(interfaces.IForm, IPagelet):
     def update():
         """Update the step."""
 
+    def updateForwarded():
+        """Update the step as target of an internal forward.
+
+        Sets forwarded and calls update.
+        """
+
+    def getRenderMode():
+        """Return the requested render mode, fragment, json or None."""
+
+    def getJSONData():
+        """Return the step data rendered in the json render mode."""
+
     def render():
         """Render the step content w/o wrapped layout."""
 
@@ -174,6 +299,79 @@ class IWizard(zope.location.interfaces.ILocation):
         default=True,
         required=False)
 
+    useStepManifest = zope.schema.Bool(
+        title='Use step manifest',
+        description='Use the step names recorded by the wizardStep directive',
+        default=False,
+        required=False)
+
+    useStepGraph = zope.schema.Bool(
+        title='Use step graph',
+        description='Follow the step successors instead of filter and order',
+        default=False,
+        required=False)
+
+    startStepName = zope.schema.TextLine(
+        title='Start step name',
+        description='First step of the step graph, default lowest weight',
+        required=False)
+
+    forwardSteps = zope.schema.Bool(
+        title='Forward steps',
+        description='Render the next step instead of redirecting to it',
+        default=False,
+        required=False)
+
+    forwardURLHeader = zope.schema.ASCIILine(
+        title='Forward URL header',
+        description='Response header reporting the URL of a forwarded step',
+        default='X-Wizard-URL',
+        required=False)
+
+    checkExecutor = zope.interface.Attribute(
+        """Executor for the checks of steps with checkConcurrently set.
+
+        E.g. a bounded concurrent.futures.ThreadPoolExecutor. The checks get
+        evaluated in the current thread if no executor is given.
+        """)
+
+    checkTimeout = zope.schema.Float(
+        title='Check timeout',
+        description='Seconds to wait for the concurrent checks per request',
+        default=None,
+        required=False)
+
+    availableFallback = zope.schema.Bool(
+        title='Available fallback',
+        description='Available value used for timed out checks',
+        default=False,
+        required=False)
+
+    completedFallback = zope.schema.Bool(
+        title='Completed fallback',
+        description='Completed value used for timed out checks',
+        default=False,
+        required=False)
+
+    availableCache = zope.interface.Attribute(
+        """LRUCache storing the available values of the steps with an
+        availableCacheTTL between requests.""")
+
+    dataStore = zope.schema.Object(
+        title='Data store',
+        description='Stores the step data until the wizard gets completed',
+        schema=IWizardDataStore,
+        required=False)
+
+    combineStagedChanges = zope.schema.Bool(
+        title='Combine staged changes',
+        description='Apply the staged data with one event per content',
+        default=False,
+        required=False)
+
+    stagedData = zope.interface.Attribute(
+        """Staged data by step name or None if no data get staged.""")
+
     confirmationPageName = zope.schema.ASCIILine(
         title='Confirmation page name',
         description='The confirmation page name shown after completed',
@@ -195,10 +393,114 @@ class IWizard(zope.location.interfaces.ILocation):
     stepInterface = zope.interface.Attribute('Step lookup interface.')
 
     steps = zope.interface.Attribute(
-        """List of one or more IStep (can be lazy).""")
+        """List of one or more IStep (can be StepInfo records).
+
+        The list gets set up, filtered and ordered only once per wizard
+        instance. Use invalidateSteps if the step availability changes.
+        """)
+
+    stepIndex = zope.interface.Attribute(
+        """Navigation index of the steps.
+
+        Offers the step positions by name and the first, last, previous and
+        next step names.
+        """)
 
     stepMenu = zope.interface.Attribute("""Step menu info.""")
 
+    useCompletionBitmap = zope.schema.Bool(
+        title='Use completion bitmap',
+        description='Keep the completed states in an annotation',
+        default=False,
+        required=False)
+
+    invariants = zope.interface.Attribute(
+        """Sequence of cross-step z3c.wizard.validation.Invariant.
+
+        The wizard only gets completed if no invariant is violated.""")
+
+    invariantErrors = zope.interface.Attribute(
+        """List of the Invalid errors of the violated invariants.
+
+        The invariant results get cached until a field they depend on
+        changes. With useCompletionBitmap the results get stored in an
+        annotation of the context, invariant names must be unique then.""")
+
+    progressTokenSecret = zope.interface.Attribute(
+        """Secret used for sign the progress token.
+
+        If set, the current step, the completed steps and the staged data get
+        kept in a signed progress token instead of on the server.""")
+
+    progressTokenName = zope.schema.ASCIILine(
+        title='Progress token name',
+        description='Name of the progress token form field and cookie',
+        default='wizard.progress')
+
+    progressTokenCookie = zope.schema.Bool(
+        title='Progress token cookie',
+        description='Set the progress token as cookie too',
+        default=False,
+        required=False)
+
+    progressTokenCompress = zope.schema.Bool(
+        title='Compress progress token',
+        description='Compress the progress token with zlib',
+        default=False,
+        required=False)
+
+    progressTokenMaxAge = zope.schema.Int(
+        title='Progress token max age',
+        description='Seconds a progress token is valid',
+        required=False)
+
+    progressState = zope.interface.Attribute(
+        """Progress state loaded from the progress token.""")
+
+    progressToken = zope.interface.Attribute(
+        """Signed token of the progress state or None.""")
+
+    submissionRecord = zope.interface.Attribute(
+        """LRUCache recording the redirect target per submission key.
+
+        If set, duplicate submissions get answered with the redirect target
+        of the first submission without executing any action.""")
+
+    submissionKeyName = zope.schema.ASCIILine(
+        title='Submission key name',
+        description='Name of the submission key form field',
+        default='wizard.submission')
+
+    submissionTTL = zope.schema.Int(
+        title='Submission TTL',
+        description='Seconds a submission key gets recorded',
+        required=False)
+
+    submissionWait = zope.schema.Float(
+        title='Submission wait',
+        description='Seconds a duplicate waits for the first submission',
+        default=5.0,
+        required=False)
+
+    submissionKey = zope.interface.Attribute(
+        """Submission key of the rendered form or None.""")
+
+    stepMenuCache = zope.interface.Attribute(
+        """Optional cache for the step menu items.
+
+        The items get keyed on the base URL, the selected step name and the
+        step names. Only use the cache if the step labels and visibility do
+        not depend on the request. The cached items must not get changed.
+        """)
+
+    completionCache = zope.interface.Attribute(
+        """Cache of the completed state of steps.
+
+        The cache is keyed on the content identity and the step cache key and
+        lives as long as the wizard. The steps invalidate the states of the
+        content they change.
+        """)
+
     step = zope.schema.Object(
         title='Current step',
         description='Current step',
@@ -241,6 +543,149 @@ class IWizard(zope.location.interfaces.ILocation):
         one.
         """
 
+    def buildStepMenu(steps, selected, baseURL):
+        """Return the step menu items for the given steps."""
+
+    def getDataStoreKey():
+        """Return the data store key or None if no data should get staged."""
+
+    def getStagedData(step):
+        """Return the staged data dict of the step or None."""
+
+    def saveStagedData(step):
+        """Stage the data of the step which applied changes.
+
+        The staged data get saved in the data store or the progress token.
+        """
+
+    def applyStagedData():
+        """Apply the staged data of all steps and remove it from the store."""
+
+    def timePhase(phase):
+        """Return a context manager timing the given phase.
+
+        The timing gets recorded by the ITimingCollector utility if any.
+        """
+
+    def getCachedAvailable(step):
+        """Return the cached available value of the step or None."""
+
+    def cacheAvailable(step, available):
+        """Cache the available value if the step has an availableCacheTTL.
+
+        Returns the available value as bool.
+        """
+
+    def isConcurrentCheck(step):
+        """Return True if the checks of the step run in the check executor."""
+
+    def prefetchCompleted(steps):
+        """Evaluate the completed states of the concurrent steps at once.
+
+        The states get stored in the completion cache.
+        """
+
+    def isStepCompleted(step):
+        """Return the (cached) completed state of the given step."""
+
+    def getProgressTokenScope():
+        """Return the wizard URL and principal id the token is bound to."""
+
+    def saveProgressState():
+        """Set the progress token cookie if progressTokenCookie is set."""
+
+    def resetProgressState():
+        """Forget the progress and expire the progress token cookie."""
+
+    def isProgressCompleted(step):
+        """Return True if the progress token marks the step completed."""
+
+    def markProgressCompleted(step):
+        """Mark the step completed in the progress state."""
+
+    def replaySubmission():
+        """Set the recorded redirect target of a duplicate submission.
+
+        Returns True if the submission is a duplicate. Otherwise the
+        submission key gets reserved until recordSubmission gets called.
+        """
+
+    def recordSubmission():
+        """Record the redirect target for the reserved submission key.
+
+        The redirect target gets recorded when the transaction commits. The
+        key gets released if the submission has no redirect target or the
+        transaction gets aborted.
+        """
+
+    def queryBitmapCompleted(step):
+        """Return the completed state stored in the completion bitmap.
+
+        Returns None if the state is not known.
+        """
+
+    def storeBitmapCompleted(step, content, completed):
+        """Store the completed state if the step edits the context."""
+
+    def storeBitmap():
+        """Store the completed states computed during the request.
+
+        Gets called by doNext and doComplete, rendering a step doesn't write
+        the completion bitmap. Stores the invariant results too.
+        """
+
+    def storeInvariantResults():
+        """Store the invariant results computed during the request.
+
+        Only the results of invariants depending on fields of the context
+        get stored.
+        """
+
+    def recordFunnel(event, stepName=None):
+        """Record the funnel event with the IFunnelRecorder utility if any.
+
+        The step name defaults to the name of the current step.
+        """
+
+    def getInvariantValues(fieldNames):
+        """Return the step values of the fields keyed by schema field name.
+
+        The value of the first step containing a field gets used.
+        """
+
+    def invalidateInvariants(fieldNames=None):
+        """Forget the results of the invariants depending on the fields.
+
+        Forget all results if no field names are given.
+        """
+
+    def getButtonCondition(name):
+        """Return the button condition with the given name of the step.
+
+        The value gets memoized until an action of the step got executed.
+        """
+
+    def followSteps(steps):
+        """Return the path from the start step along the step successors.
+
+        The path starts with the start step or, if it is not available,
+        with the first available step by weight. Only the conditions and the
+        available values of the steps on the path get evaluated.
+        """
+
+    def getSuccessor(step, stepsByName):
+        """Return the first available successor of the step or None."""
+
+    def isStepAvailable(step):
+        """Return the (cached) available value of the step."""
+
+    def invalidateSteps():
+        """Forget the computed steps.
+
+        The next access to steps will set up, filter and order them again.
+        Call this method if a handler changes the availability of a step.
+        """
+
     def getDefaultStep():
         """Can return the first or first not completed step as default."""
 
@@ -253,6 +698,19 @@ class IWizard(zope.location.interfaces.ILocation):
     def browserDefault(request):
         """The default step is our browserDefault traversal setp."""
 
+    def forward():
+        """Switch to the step given by nextURL and update it.
+
+        Returns the updated step if forwardSteps is set and the next URL
+        points to a step of this wizard, otherwise None.
+        """
+
+    def getStepURL(stepName, baseURL=None):
+        """Return the URL of the step used for redirects and the step menu.
+
+        The base URL of the wizard gets used if no baseURL is given.
+        """
+
     def goToStep(stepName):
         """Redirect to the step by name."""
 
@@ -0,0 +1,83 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Wizard step manifest built at configuration time."""
+__docformat__ = "reStructuredText"
+
+import zope.interface
+from zope.interface.interfaces import IInterface
+
+
+def _asSpecification(spec):
+    """Return the specification used for match a for_, layer or wizard."""
+    if spec is None:
+        return zope.interface.Interface
+    if IInterface.providedBy(spec):
+        return spec
+    return zope.interface.implementedBy(spec)
+
+
+class StepManifest:
+    """Step names and weights recorded by the wizardStep directive.
+
+    The steps get recorded per (for_, layer, wizard) key. The sorted step
+    names for a (context, request, wizard) combination get computed once and
+    are cached by the provided specifications of these objects.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._steps = {}
+        self._cache = {}
+
+    def addStep(self, for_, layer, wizard, name, weight=0):
+        key = (_asSpecification(for_), _asSpecification(layer),
+               _asSpecification(wizard))
+        self._steps.setdefault(key, {})[name] = weight
+        self._cache.clear()
+
+    def getStepNames(self, context, request, wizard):
+        """Return the step names ordered by weight.
+
+        Returns an empty tuple if no step is known for the given objects.
+        """
+        specs = (zope.interface.providedBy(context),
+                 zope.interface.providedBy(request),
+                 zope.interface.providedBy(wizard))
+        names = self._cache.get(specs)
+        if names is None:
+            names = self._cache[specs] = self._computeStepNames(specs)
+        return names
+
+    def _computeStepNames(self, specs):
+        weights = {}
+        for key, steps in self._steps.items():
+            for spec, required in zip(specs, key):
+                if not spec.isOrExtends(required):
+                    break
+            else:
+                weights.update(steps)
+        return tuple(sorted(weights, key=weights.get))
+
+
+stepManifest = StepManifest()
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ModuleNotFoundError:  # pragma: no cover
+    pass
+else:
+    addCleanUp(stepManifest.clear)
+    del addCleanUp
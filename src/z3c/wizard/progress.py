@@ -0,0 +1,90 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Signed wizard progress tokens.
+
+A token contains the JSON encoded progress state, optionally compressed with
+zlib, and a HMAC-SHA256 signature of it. The state is only signed and not
+encrypted, don't put secrets into it.
+"""
+__docformat__ = "reStructuredText"
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+import zlib
+
+
+class InvalidToken(ValueError):
+    """The token is malformed, has a wrong signature or is expired."""
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload, secret):
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, payload, hashlib.sha256).digest()
+
+
+def dumpToken(state, secret, compress=False, scope=None):
+    """Return the signed token of the JSON serializable state.
+
+    The token is only valid for the given scope, e.g. the wizard URL and
+    the principal id.
+    """
+    data = dict(state, t=int(time.time()), s=scope)
+    payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if compress:
+        payload = b'z' + zlib.compress(payload)
+    else:
+        payload = b'j' + payload
+    return '{}.{}'.format(_encode(payload), _encode(_sign(payload, secret)))
+
+
+def loadToken(token, secret, maxAge=None, scope=None):
+    """Return the state of the signed token.
+
+    Raises InvalidToken if the token is not valid, older than maxAge seconds
+    or issued for another scope.
+    """
+    try:
+        payload, signature = (_decode(part) for part in token.split('.'))
+    except (ValueError, TypeError):
+        raise InvalidToken('Malformed token')
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        raise InvalidToken('Wrong signature')
+    try:
+        if payload[:1] == b'z':
+            payload = zlib.decompress(payload[1:])
+        else:
+            payload = payload[1:]
+        data = json.loads(payload.decode('utf-8'))
+    except (ValueError, zlib.error):
+        raise InvalidToken('Malformed token')
+    if not isinstance(data, dict):
+        raise InvalidToken('Malformed token')
+    if data.pop('s', None) != scope:
+        raise InvalidToken('Token issued for another scope')
+    created = data.pop('t', 0)
+    if maxAge is not None and created + maxAge < time.time():
+        raise InvalidToken('Expired token')
+    return data
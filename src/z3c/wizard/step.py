@@ -11,16 +11,53 @@
 # FOR A PARTICULAR PURPOSE.
 #
 ##############################################################################
+import json
+
 import zope.component
 import zope.event
+import zope.i18n
 import zope.interface
 import zope.lifecycleevent
 from z3c.form import button
+from z3c.form.interfaces import INPUT_MODE
+from z3c.form.interfaces import IDataConverter
 from z3c.form.interfaces import IDataManager
+from z3c.form.interfaces import IFieldWidget
 from z3c.formui import form
+from z3c.template.interfaces import IContentTemplate
+from zope.interface.interfaces import ComponentLookupError
 
 from z3c.wizard import interfaces
 from z3c.wizard.interfaces import _
+from z3c.wizard.timing import noPhaseTimer
+
+
+def notifyModified(content, changes):
+    """Send a detailed object-modified event for the given changes."""
+    # Construct change-descriptions for the object-modified event
+    descriptions = []
+    for interface, names in changes.items():
+        descriptions.append(zope.lifecycleevent.Attributes(interface, *names))
+    zope.event.notify(
+        zope.lifecycleevent.ObjectModifiedEvent(content, *descriptions))
+
+
+def callWizard(wizard, name, *args, default=None):
+    """Call the wizard method or return the default if there is none.
+
+    IWizard implementations not based on Wizard may lack the newer methods.
+    """
+    method = getattr(wizard, name, None)
+    if method is None:
+        return default
+    return method(*args)
+
+
+def invalidateCompleted(wizard, content):
+    """Forget the cached completed states of the changed content."""
+    completionCache = getattr(wizard, 'completionCache', None)
+    if completionCache is not None:
+        completionCache.invalidate(content)
 
 
 def addStep(self, name, label=None, weight=None, available=None, **kws):
@@ -38,6 +75,144 @@ def addStep(self, name, label=None, weight=None, available=None, **kws):
     return step
 
 
+_marker = object()
+
+
+def getStaticAttribute(factory, name, default=None):
+    """Return a plain class attribute of a step factory.
+
+    Returns the default if the attribute is computed e.g. by a property.
+    """
+    for klass in getattr(factory, '__mro__', ()):
+        if name in klass.__dict__:
+            value = klass.__dict__[name]
+            if hasattr(type(value), '__get__'):
+                return default
+            return value
+    return default
+
+
+class StepInfo:
+    """Compact step record which creates the step form only if needed.
+
+    The step info offers the name, label, weight, available and visible
+    attributes used by the wizard navigation without creating the step if
+    the step factory defines them as plain class attributes. Any other
+    attribute access creates the step.
+    """
+
+    __slots__ = ('__name__', 'wizard', 'factory', '_step')
+
+    def __init__(self, wizard, name, factory):
+        self.__name__ = name
+        self.wizard = wizard
+        self.factory = factory
+        self._step = None
+
+    @property
+    def step(self):
+        """The real step."""
+        if self._step is None:
+            wizard = self.wizard
+            step = self.factory(wizard.context, wizard.request, wizard)
+            step.__name__ = self.__name__
+            self._step = step
+        return self._step
+
+    @property
+    def label(self):
+        return self.queryAttribute('label')
+
+    @property
+    def weight(self):
+        return self.queryAttribute('weight')
+
+    @property
+    def available(self):
+        return self.queryAttribute('available')
+
+    @property
+    def visible(self):
+        return self.queryAttribute('visible')
+
+    def queryAttribute(self, name, default=None):
+        """Return an attribute, prefer the class attribute of the factory."""
+        if self._step is None:
+            value = getStaticAttribute(self.factory, name, _marker)
+            if value is not _marker:
+                return value
+        return getattr(self.step, name, default)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.step, name)
+
+    def __setattr__(self, name, value):
+        if name in StepInfo.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.step, name, value)
+
+    def __repr__(self):
+        return "<{} '{}'>".format(self.__class__.__name__, self.__name__)
+
+
+def getDataManagerFactory(content, field):
+    """Return the IDataManager factory for the given content and field.
+
+    The adapter registry caches the factory per provided specification of
+    the content and field and clears that cache if the registry changes.
+    """
+    adapters = zope.component.getSiteManager().adapters
+    factory = adapters.lookup(
+        (zope.interface.providedBy(content), zope.interface.providedBy(field)),
+        IDataManager)
+    if factory is None:
+        raise ComponentLookupError((content, field), IDataManager, '')
+    return factory
+
+
+def queryStepAttribute(step, name, default=None):
+    """Return a step attribute without creating the form of a step info.
+
+    The form of a step info only gets created if the attribute is not a
+    plain class attribute of the step factory.
+    """
+    if isinstance(step, StepInfo):
+        return step.queryAttribute(name, default)
+    return getattr(step, name, default)
+
+
+def getSteps(wizard, stepInterface=interfaces.IStep, names=None):
+    """Return the steps registered as adapters for the given wizard.
+
+    Steps registered with a class as factory get returned as StepInfo. Other
+    factories get called like getAdapters would do it. If names are given,
+    only the steps with these names get looked up.
+    """
+    objects = (wizard.context, wizard.request, wizard)
+    required = tuple(zope.interface.providedBy(obj) for obj in objects)
+    adapters = zope.component.getSiteManager().adapters
+    if names is None:
+        factories = adapters.lookupAll(required, stepInterface)
+    else:
+        factories = [(name, adapters.lookup(required, stepInterface, name))
+                     for name in names]
+    steps = []
+    for name, factory in factories:
+        if factory is None:
+            continue
+        if isinstance(factory, type):
+            steps.append(StepInfo(wizard, name, factory))
+            continue
+        step = factory(*objects)
+        if step is not None:
+            step.__name__ = name
+            steps.append(step)
+    return steps
+
+
 @zope.interface.implementer(interfaces.IStep)
 class Step(form.Form):
     """Wizard base step implementation.
@@ -54,6 +229,10 @@ class Step(form.Form):
     is not a part of this implementation. This wizard implementation works
     on any context like other z3c.form IForm implementations. For more infos
     see z3c.form which this wizard is based on.
+
+    If the wizard uses an IWizardDataStore, the step content is a dict with
+    the staged step data. The staged data get applied to the target content
+    if the wizard gets completed.
     """
 
     label = None
@@ -69,6 +248,29 @@ class Step(form.Form):
     # button condition
     showSaveButton = True
 
+    # evaluate available and completed with the wizard checkExecutor, only
+    # use it if these checks are thread-safe (e.g. don't load ZODB objects)
+    checkConcurrently = False
+
+    # (step name, condition) pairs used by wizards with useStepGraph set. The
+    # first successor with a condition of None or a condition returning True
+    # for the wizard is the next step.
+    successors = ()
+
+    # reuse the available value between requests for the given seconds, the
+    # value gets cached by getAvailableCacheKey
+    availableCacheTTL = None
+
+    # partial rendering, see getRenderMode
+    renderModeHeader = 'X-Wizard-Render'
+    renderModeParameter = 'wizard.render'
+
+    # for internal use
+    _dataManagers = None
+    forwarded = False
+    forwardedStep = None
+    _action = None
+
     formErrorsMessage = _('There were some errors.')
     successMessage = _('Data successfully updated.')
     noChangesMessage = _('No changes were applied.')
@@ -107,16 +309,69 @@ class Step(form.Form):
         additional condition in your custom step implementation.
         """
         content = self.getContent()
-        for field in self.fields.values():
+        for name, field in self.fields.items():
             if not field.field.required:
                 continue
-            dm = zope.component.getMultiAdapter(
-                (content, field.field), IDataManager)
+            dm = self.getDataManager(content, name, field.field)
             if dm.query(
                     field.field.missing_value) is field.field.missing_value:
                 return False
         return True
 
+    def getContent(self):
+        """Return the staged data or the target content."""
+        data = self.queryStagedData()
+        if data is not None:
+            return data
+        return self.getTargetContent()
+
+    def getTargetContent(self):
+        """Return the content the step data get applied to.
+
+        Override this method instead of getContent if the step edits another
+        object than the context, the step data get staged then too.
+        """
+        return super().getContent()
+
+    def queryStagedData(self):
+        """Return the staged data of the step or None if not staged."""
+        return callWizard(self.wizard, 'getStagedData', self)
+
+    def getDataManager(self, content, name, field):
+        """Return the data manager for the given content and form field name.
+
+        The data managers get cached per content for the lifetime of the step.
+        """
+        if self._dataManagers is None or self._dataManagers[0] is not content:
+            self._dataManagers = (content, {})
+        dataManagers = self._dataManagers[1]
+        dm = dataManagers.get(name)
+        if dm is None:
+            factory = getDataManagerFactory(content, field)
+            dm = dataManagers[name] = factory(content, field)
+        return dm
+
+    def getAvailableCacheKey(self):
+        """Return the key used for cache the available value.
+
+        The available value only gets cached if availableCacheTTL is set. The
+        default key is unique per step, wizard URL and principal. Return a
+        more generic key if the value is the same e.g. for all principals.
+        """
+        principal = getattr(self.request, 'principal', None)
+        principalId = principal.id if principal is not None else None
+        return (self.__name__, self.wizard.baseURL, principalId)
+
+    def getCompletedCacheKey(self):
+        """Return the key used for cache the completed state.
+
+        The wizard caches the completed state per content and this key. The
+        cache gets invalidated by an ObjectModifiedEvent for the content.
+        Return None if the completed state should not get cached e.g. if it
+        depends on something else than the content.
+        """
+        return self.__name__
+
     def goToStep(self, stepName):
         self.wizard.goToStep(stepName)
 
@@ -132,15 +387,80 @@ class Step(form.Form):
         changes = form.applyChanges(self, content, data)
         # ``changes`` is a dictionary; if empty, there were no changes
         if changes:
-            # Construct change-descriptions for the object-modified event
-            descriptions = []
-            for interface, names in changes.items():
-                descriptions.append(
-                    zope.lifecycleevent.Attributes(interface, *names))
             # Send out a detailed object-modified event
-            zope.event.notify(
-                zope.lifecycleevent.ObjectModifiedEvent(
-                    content, *descriptions))
+            notifyModified(content, changes)
+            invalidateCompleted(self.wizard, content)
+            # validate the invariants depending on the changed fields again,
+            # the invariants depend on schema field names
+            callWizard(self.wizard, 'invalidateInvariants',
+                       [self.fields[name].field.__name__
+                        for names in changes.values() for name in names])
+            staged = self.queryStagedData()
+            if staged is not None and content is staged:
+                # keep the staged data in the wizard data store
+                self.wizard.saveStagedData(self)
+        return changes
+
+    def getStagedChanges(self):
+        """Return the staged data keyed by form field name."""
+        staged = self.queryStagedData()
+        if staged is None:
+            return {}
+        data = {}
+        for name, field in self.fields.items():
+            fieldName = field.field.__name__
+            if fieldName in staged:
+                data[name] = staged[fieldName]
+        return data
+
+    def getStagedConverter(self, name):
+        """Return the data converter of the input widget of the form field."""
+        field = self.fields[name]
+        factory = field.widgetFactory.get(INPUT_MODE)
+        if factory is not None:
+            widget = factory(field.field, self.request)
+        else:
+            widget = zope.component.getMultiAdapter(
+                (field.field, self.request), IFieldWidget)
+        widget.context = self.getTargetContent()
+        widget.form = self
+        widget.ignoreContext = True
+        return IDataConverter(widget)
+
+    def dumpStagedData(self, data):
+        """Return the staged data as JSON serializable widget values.
+
+        The widget values get converted back to field values by
+        loadStagedData, e.g. for keep the staged data in a progress token.
+        """
+        values = {}
+        for name, field in self.fields.items():
+            fieldName = field.field.__name__
+            if fieldName in data:
+                converter = self.getStagedConverter(name)
+                values[fieldName] = converter.toWidgetValue(data[fieldName])
+        return values
+
+    def loadStagedData(self, values):
+        """Return the staged data of the widget values."""
+        data = {}
+        for name, field in self.fields.items():
+            fieldName = field.field.__name__
+            if fieldName in values:
+                converter = self.getStagedConverter(name)
+                data[fieldName] = converter.toFieldValue(values[fieldName])
+        return data
+
+    def applyStagedData(self):
+        """Apply the staged step data to the target content."""
+        data = self.getStagedChanges()
+        if not data:
+            return {}
+        content = self.getTargetContent()
+        changes = form.applyChanges(self, content, data)
+        if changes:
+            notifyModified(content, changes)
+            invalidateCompleted(self.wizard, content)
         return changes
 
     def doHandleApply(self, action):
@@ -148,6 +468,7 @@ class Step(form.Form):
         data, errors = self.extractData()
         if errors:
             self.status = self.formErrorsMessage
+            callWizard(self.wizard, 'recordFunnel', 'invalid', self.__name__)
             return False
         changes = self.applyChanges(data)
         if changes:
@@ -175,22 +496,141 @@ class Step(form.Form):
         return True
 
     def update(self):
-        # setup wizard actions
-        self.wizard.update()
+        wizard = self.wizard
+        with callWizard(wizard, 'timePhase', 'Step.update',
+                        default=noPhaseTimer):
+            # setup wizard actions
+            wizard.update()
+            if self.forwarded:
+                # the request got submitted to the forwarding step
+                if self.nextURL is None:
+                    self.updateWidgets()
+                    self.updateActions()
+                return
+            if (self.nextURL is None
+                    and not callWizard(wizard, 'replaySubmission')):
+                try:
+                    # update and execute step actions
+                    super().update()
+                    # execute wizard actions
+                    with callWizard(wizard, 'timePhase', 'executeActions',
+                                    default=noPhaseTimer):
+                        wizard.actions.execute()
+                finally:
+                    # answer duplicates of this submission with the same
+                    # target or release the submission key
+                    callWizard(wizard, 'recordSubmission')
+            if self.nextURL is not None:
+                # forward to the next step or redirect in render method
+                self.forwardedStep = callWizard(wizard, 'forward')
+
+    def updateForwarded(self):
+        """Update the step as target of an internal forward.
+
+        The request values and buttons belong to the forwarding step. The
+        step gets updated with widgets ignoring the request and without
+        executing any action.
+        """
+        self.ignoreRequest = True
+        self.forwarded = True
+        # submit the rendered form to this step instead of the forwarding one
+        self._action = '{}/{}'.format(self.wizard.baseURL, self.__name__)
+        self.update()
+
+    @property
+    def action(self):
+        """See interfaces.IInputForm"""
+        if self._action is not None:
+            return self._action
+        return super().action
+
+    def getRenderMode(self):
+        """Return the requested render mode.
+
+        The mode ``fragment`` renders only the step form without the wizard
+        layout and the mode ``json`` returns the step data as JSON document.
+        Returns None for a full page rendering.
+        """
+        mode = self.request.getHeader(self.renderModeHeader)
+        if mode is None:
+            mode = self.request.form.get(self.renderModeParameter)
+        if mode in ('fragment', 'json'):
+            return mode
+        return None
+
+    def translate(self, msgid):
+        if msgid is None:
+            return None
+        return zope.i18n.translate(msgid, context=self.request)
+
+    def getJSONData(self):
+        """Return the step data rendered in the json render mode."""
+        data = {'name': self.__name__, 'nextURL': self.nextURL}
         if self.nextURL is not None:
-            # abort and do redirect in render method
-            return
-        # update and execute step actions
-        super().update()
-        # execute wizard actions
-        self.wizard.actions.execute()
+            return data
+        translate = self.translate
+        wizard = self.wizard
+        data['label'] = translate(self.label)
+        data['status'] = translate(self.status) or None
+        data['stepMenu'] = [dict(item, title=translate(item['title']))
+                            for item in wizard.stepMenu]
+        data['widgets'] = [{
+            'name': widget.name,
+            'id': widget.id,
+            'label': translate(widget.label),
+            'value': widget.value,
+            'required': widget.required,
+            'mode': widget.mode,
+            'error': translate(widget.error.message) if widget.error else None,
+        } for widget in self.widgets.values()]
+        data['errors'] = [{
+            'widget': error.widget.name if error.widget else None,
+            'message': translate(error.message),
+        } for error in self.widgets.errors]
+        data['buttons'] = {
+            'back': bool(wizard.showBackButton),
+            'next': bool(wizard.showNextButton),
+            'complete': bool(wizard.showCompleteButton),
+        }
+        data['actions'] = [action.name for action in self.actions.values()]
+        token = getattr(wizard, 'progressToken', None)
+        if token is not None:
+            data['progress'] = token
+        key = getattr(wizard, 'submissionKey', None)
+        if key is not None:
+            data['submission'] = key
+        if getattr(wizard, 'invariants', None):
+            data['invariantErrors'] = [
+                translate(error.args[0]) if error.args else str(error)
+                for error in wizard.invariantErrors]
+        return data
+
+    def __call__(self):
+        if self.getRenderMode() is None:
+            return super().__call__()
+        # partial renderings don't get wrapped in the layout template
+        self.update()
+        return self.render()
 
     def render(self):
+        if self.forwardedStep is not None:
+            return self.forwardedStep.render()
         # render content template
+        mode = self.getRenderMode()
+        if mode == 'json':
+            self.request.response.setHeader(
+                'Content-Type', 'application/json')
+            return json.dumps(self.getJSONData(), default=str)
         if self.nextURL is not None:
             self.request.response.redirect(self.nextURL)
             return ''
-        return super().render()
+        with callWizard(self.wizard, 'timePhase', 'Step.render',
+                        default=noPhaseTimer):
+            if mode == 'fragment':
+                template = zope.component.getMultiAdapter(
+                    (self, self.request), IContentTemplate, name='fragment')
+                return template(self)
+            return super().render()
 
     def __repr__(self):
         return "<{} '{}'>".format(self.__class__.__name__, self.__name__)
@@ -13,18 +13,60 @@
 ##############################################################################
 """Wizard button actions implementation."""
 
+import concurrent.futures
+import datetime
+import decimal
 import doctest
+import json
+import os
+import tempfile
+import threading
+import time
+import types
 import unittest
 
+import transaction
+import zope.component
+import zope.event
 import zope.interface
+import zope.schema
+import zope.schema.interfaces
+import zope.security.checker
+import zope.security.testing
+from z3c.form import button
+from z3c.form import converter
+from z3c.form import datamanager
+from z3c.form import field
+from z3c.form import term
+from z3c.form.browser import select
+from z3c.form.browser import text
+from z3c.form.interfaces import IButtonAction
+from z3c.form.interfaces import IFormLayer
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.authentication.interfaces import IUnauthenticatedPrincipal
+from zope.component.hooks import getSite
+from zope.component.hooks import setSite
 from zope.interface.verify import verifyClass
 from zope.interface.verify import verifyObject
+from zope.lifecycleevent import Attributes
+from zope.lifecycleevent import ObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
 from zope.publisher.browser import TestRequest
+from zope.publisher.interfaces import NotFound
 
+from z3c.wizard import benchmark
+from z3c.wizard import completion
+from z3c.wizard import datastore
+from z3c.wizard import funnel
 from z3c.wizard import interfaces
+from z3c.wizard import progress
 from z3c.wizard import step
 from z3c.wizard import testing
+from z3c.wizard import timing
+from z3c.wizard import validation
 from z3c.wizard import wizard
+from z3c.wizard.cache import LRUCache
 
 
 class IContentStub(zope.interface.Interface):
@@ -93,6 +135,1628 @@ class TestWizard(unittest.TestCase):
         self.assertTrue(verifyObject(interfaces.IWizard, wiz))
 
 
+class CountingWizard(wizard.Wizard):
+    """Wizard counting the step setup calls."""
+
+    baseURL = '#'
+    setUpCalls = 0
+
+    def setUpSteps(self):
+        self.setUpCalls += 1
+        return super().setUpSteps()
+
+
+class TestWizardSteps(unittest.TestCase):
+
+    def setUp(self):
+        setStubs()
+
+    def test_steps_computed_once(self):
+        wiz = CountingWizard(ContentStub(), TestRequest())
+        wiz.publishTraverse(wiz.request, 'first')
+        wiz.stepMenu
+        wiz.previousStepName
+        wiz.nextStepName
+        wiz.completed
+        self.assertEqual(wiz.setUpCalls, 1)
+        self.assertIs(wiz.steps, wiz.steps)
+
+    def test_invalidateSteps(self):
+        wiz = CountingWizard(ContentStub(), TestRequest())
+        steps = wiz.steps
+        wiz.invalidateSteps()
+        self.assertIsNot(wiz.steps, steps)
+        self.assertEqual(
+            [step.__name__ for step in wiz.steps], ['first', 'last'])
+        self.assertEqual(wiz.setUpCalls, 2)
+
+
+class TestStepIndex(unittest.TestCase):
+
+    def setUp(self):
+        setStubs()
+
+    def test_index(self):
+        steps = [StepTestClass(None, None, None) for idx in range(3)]
+        for name, step_inst in zip(('a', 'b', 'c'), steps):
+            step_inst.__name__ = name
+        index = wizard.StepIndex(steps)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.positions, {'a': 0, 'b': 1, 'c': 2})
+        self.assertEqual((index.first, index.last), ('a', 'c'))
+        self.assertEqual(index.previous, {'b': 'a', 'c': 'b'})
+        self.assertEqual(index.next, {'a': 'b', 'b': 'c'})
+
+    def test_empty(self):
+        index = wizard.StepIndex([])
+        self.assertEqual((index.first, index.last), (None, None))
+
+    def test_navigation(self):
+        wiz = wizard.Wizard(ContentStub(), TestRequest())
+        first = wiz.publishTraverse(wiz.request, 'first.html')
+        self.assertEqual(first.__name__, 'first')
+        self.assertTrue(wiz.isFirstStep)
+        self.assertFalse(wiz.isLastStep)
+        self.assertIsNone(wiz.previousStepName)
+        self.assertEqual(wiz.nextStepName, 'last')
+        wiz.publishTraverse(wiz.request, 'last')
+        self.assertTrue(wiz.isLastStep)
+        self.assertEqual(wiz.previousStepName, 'first')
+        self.assertIsNone(wiz.nextStepName)
+        self.assertRaises(
+            NotFound, wiz.publishTraverse, wiz.request, 'unknown')
+
+
+class CountingStep(step.Step):
+    """Step counting the completed checks."""
+
+    checks = 0
+
+    @property
+    def completed(self):
+        CountingStep.checks += 1
+        return True
+
+
+class UncachedStep(CountingStep):
+    """Step opting out of the completion cache."""
+
+    def getCompletedCacheKey(self):
+        return None
+
+
+class TestCompletionCache(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(
+            CountingStep, (IContentStub, None, None),
+            provides=interfaces.IStep, name='first')
+        zope.component.provideAdapter(
+            UncachedStep, (IContentStub, None, None),
+            provides=interfaces.IStep, name='last')
+        CountingStep.checks = 0
+
+    def tearDown(self):
+        setStubs()
+
+    def test_cached(self):
+        wiz = wizard.Wizard(ContentStub(), TestRequest())
+        self.assertTrue(wiz.completed)
+        self.assertTrue(wiz.completed)
+        # the first step got checked once, the uncached step twice
+        self.assertEqual(CountingStep.checks, 3)
+
+    def test_invalidated_by_changes(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        content = NameContent()
+        wiz = LinearWizard(content, TestRequest())
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        self.assertFalse(wiz.isStepCompleted(nameStep))
+        self.assertFalse(wiz.completionCache.get(content, 'name'))
+        wiz.completionCache.set(ContentStub(), 'name', False)
+        nameStep.applyChanges({'name': 'Roger'})
+        self.assertIsNone(wiz.completionCache.get(content, 'name'))
+        self.assertTrue(wiz.isStepCompleted(nameStep))
+
+
+class InitCountingStep(step.Step):
+    """Step counting its instances."""
+
+    label = 'Counting'
+    instances = 0
+
+    def __init__(self, context, request, wizard):
+        super().__init__(context, request, wizard)
+        InitCountingStep.instances += 1
+
+
+class TestStepInfo(unittest.TestCase):
+
+    def setUp(self):
+        for name, weight in (('first', 1), ('second', 2), ('third', 3)):
+            zope.component.provideAdapter(
+                type('Step', (InitCountingStep,), {'weight': weight}),
+                (IContentStub, None, None),
+                provides=interfaces.IStep, name=name)
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            required=(IContentStub, None, None),
+            provided=interfaces.IStep, name='last')
+        InitCountingStep.instances = 0
+
+    def tearDown(self):
+        for name in ('second', 'third'):
+            zope.component.getGlobalSiteManager().unregisterAdapter(
+                required=(IContentStub, None, None),
+                provided=interfaces.IStep, name=name)
+        setStubs()
+
+    def test_only_traversed_step_created(self):
+        wiz = CountingWizard(ContentStub(), TestRequest())
+        second = wiz.publishTraverse(wiz.request, 'second')
+        self.assertIsInstance(second, InitCountingStep)
+        self.assertEqual(second.__name__, 'second')
+        self.assertEqual(wiz.previousStepName, 'first')
+        self.assertEqual(wiz.nextStepName, 'third')
+        self.assertEqual(
+            [item['title'] for item in wiz.stepMenu], ['Counting'] * 3)
+        self.assertEqual(InitCountingStep.instances, 1)
+
+    def test_computed_attribute_creates_step(self):
+        wiz = wizard.Wizard(ContentStub(), TestRequest())
+        info = wiz.steps[0]
+        self.assertIsInstance(info, step.StepInfo)
+        self.assertEqual(info.weight, 1)
+        self.assertEqual(InitCountingStep.instances, 0)
+        self.assertTrue(info.completed)
+        self.assertEqual(InitCountingStep.instances, 1)
+        self.assertIs(info.step.wizard, wiz)
+        self.assertEqual(repr(info), "<StepInfo 'first'>")
+
+    def test_slots(self):
+        wiz = wizard.Wizard(ContentStub(), TestRequest())
+        info = wiz.steps[0]
+        self.assertFalse(hasattr(info, '__dict__'))
+        # other attributes get set on the step form
+        info.label = 'First'
+        self.assertEqual(info.step.label, 'First')
+        self.assertEqual(info.__name__, 'first')
+
+
+class INameContent(zope.interface.Interface):
+    """Content with a required name."""
+
+    name = zope.schema.TextLine(title='Name')
+
+
+class ICityContent(zope.interface.Interface):
+    """Content with a required city."""
+
+    city = zope.schema.TextLine(title='City')
+
+
+@zope.interface.implementer(INameContent, ICityContent)
+class NameContent:
+    """Content providing a name and a city."""
+
+    name = None
+    city = None
+
+
+class NameStep(step.Step):
+    """Step with a required name field."""
+
+    fields = field.Fields(INameContent)
+
+
+class NameDataManager(datamanager.AttributeField):
+    """Custom data manager."""
+
+
+class TestDataManager(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+
+    def test_completed(self):
+        content = NameContent()
+        step_inst = NameStep(content, TestRequest(), None)
+        self.assertFalse(step_inst.completed)
+        content.name = 'Roger'
+        self.assertTrue(step_inst.completed)
+
+    def test_getDataManager_cached_per_content(self):
+        content = NameContent()
+        step_inst = NameStep(content, TestRequest(), None)
+        dm = step_inst.getDataManager(content, 'name', INameContent['name'])
+        self.assertIs(
+            step_inst.getDataManager(content, 'name', INameContent['name']),
+            dm)
+        other = step_inst.getDataManager(
+            NameContent(), 'name', INameContent['name'])
+        self.assertIsNot(other, dm)
+
+    def test_getDataManagerFactory_follows_registry(self):
+        content = NameContent()
+        self.assertIs(
+            step.getDataManagerFactory(content, INameContent['name']),
+            datamanager.AttributeField)
+        zope.component.provideAdapter(
+            NameDataManager, (INameContent, zope.schema.interfaces.IField))
+        self.assertIs(
+            step.getDataManagerFactory(content, INameContent['name']),
+            NameDataManager)
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            NameDataManager, (INameContent, zope.schema.interfaces.IField))
+
+
+class TestStepMenu(unittest.TestCase):
+
+    def setUp(self):
+        setStubs()
+
+    def test_stepMenu(self):
+        wiz = CountingWizard(ContentStub(), TestRequest())
+        wiz.publishTraverse(wiz.request, 'last')
+        self.assertEqual(wiz.stepMenu, [
+            {'name': 'first', 'title': None, 'number': '1', 'url': '#/first',
+             'selected': False, 'class': None, 'first': True, 'last': False},
+            {'name': 'last', 'title': None, 'number': '2', 'url': '#/last',
+             'selected': True, 'class': 'selected', 'first': False,
+             'last': True},
+        ])
+
+    def test_stepMenuCache(self):
+        wiz = CountingWizard(ContentStub(), TestRequest())
+        wiz.stepMenuCache = LRUCache(10)
+        wiz.publishTraverse(wiz.request, 'first')
+        items = wiz.stepMenu
+        self.assertEqual(len(wiz.stepMenuCache), 1)
+        other = CountingWizard(ContentStub(), TestRequest())
+        other.stepMenuCache = wiz.stepMenuCache
+        other.publishTraverse(other.request, 'first')
+        self.assertIs(other.stepMenu[0], items[0])
+        other.publishTraverse(other.request, 'last')
+        self.assertTrue(other.stepMenu[1]['selected'])
+        self.assertEqual(len(wiz.stepMenuCache), 2)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        cache.invalidate('a')
+        self.assertIsNone(cache.get('a'))
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl(self):
+        cache = LRUCache(2)
+        cache.set('a', 1, ttl=0)
+        cache.set('b', 2, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_add(self):
+        cache = LRUCache(2)
+        self.assertTrue(cache.add('a', 1))
+        self.assertFalse(cache.add('a', 2))
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('b', 1, ttl=0)
+        self.assertTrue(cache.add('b', 2))
+        self.assertEqual(cache.get('b'), 2)
+
+
+class Principal:
+    """Principal stub."""
+
+    def __init__(self, id):
+        self.id = id
+
+
+class StagingWizard(wizard.Wizard):
+    """Wizard staging the step data."""
+
+    baseURL = 'http://127.0.0.1/wizard'
+    dataStore = datastore.MemoryDataStore()
+
+
+class TestDataStore(unittest.TestCase):
+
+    def test_MemoryDataStore(self):
+        store = datastore.MemoryDataStore(size=1)
+        self.assertTrue(
+            verifyObject(interfaces.IWizardDataStore, store))
+        data = {'step': {'name': 'Roger'}}
+        store.save('key', data)
+        data['step']['name'] = 'Changed'
+        self.assertEqual(store.load('key'), {'step': {'name': 'Roger'}})
+        store.save('other', {})
+        self.assertIsNone(store.load('key'))
+        store.remove('other')
+        self.assertIsNone(store.load('other'))
+
+    def test_FileDataStore(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = datastore.FileDataStore(directory)
+            self.assertTrue(
+                verifyObject(interfaces.IWizardDataStore, store))
+            self.assertIsNone(store.load('key'))
+            store.save('key', {'step': {'name': 'Roger'}})
+            self.assertEqual(store.load('key'), {'step': {'name': 'Roger'}})
+            store.remove('key')
+            store.remove('key')
+            self.assertIsNone(store.load('key'))
+            self.assertEqual(os.listdir(directory), [])
+
+
+class TestStagedData(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(datamanager.DictionaryField)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+
+    def getWizard(self, content, principal=Principal('roger')):
+        request = TestRequest()
+        request.setPrincipal(principal)
+        return StagingWizard(content, request)
+
+    def test_no_staging_for_anonymous(self):
+        content = NameContent()
+        wiz = self.getWizard(content, principal=None)
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        self.assertIs(nameStep.getContent(), content)
+        principal = Principal('zope.anybody')
+        zope.interface.alsoProvides(principal, IUnauthenticatedPrincipal)
+        wiz = self.getWizard(content, principal=principal)
+        self.assertIsNone(wiz.getDataStoreKey())
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        self.assertIs(nameStep.getContent(), content)
+
+    def test_staged_until_complete(self):
+        content = NameContent()
+        wiz = self.getWizard(content)
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        self.assertEqual(nameStep.getContent(), {})
+        nameStep.applyChanges({'name': 'Roger'})
+        self.assertIsNone(content.name)
+        # the next request knows the staged data
+        wiz = self.getWizard(content)
+        self.assertEqual(wiz.stagedData, {'name': {'name': 'Roger'}})
+        self.assertTrue(wiz.completed)
+        wiz.applyStagedData()
+        self.assertEqual(content.name, 'Roger')
+        self.assertIsNone(
+            StagingWizard.dataStore.load(wiz.getDataStoreKey()))
+
+    def test_staged_data_initialized_from_content(self):
+        content = NameContent()
+        content.name = 'Roger'
+        wiz = self.getWizard(content)
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        self.assertEqual(nameStep.getContent(), {'name': 'Roger'})
+        self.assertIs(nameStep.getTargetContent(), content)
+
+    def test_snapshots_not_staged(self):
+        zope.component.provideAdapter(
+            OtherNameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='other')
+        content = NameContent()
+        content.name = 'Old'
+        wiz = self.getWizard(content)
+        otherStep = wiz.publishTraverse(wiz.request, 'other')
+        self.assertEqual(otherStep.getContent(), {'name': 'Old'})
+        self.assertEqual(wiz.stagedData, {})
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        nameStep.applyChanges({'name': 'Roger'})
+        wiz = self.getWizard(content)
+        self.assertEqual(wiz.stagedData, {'name': {'name': 'Roger'}})
+        wiz.applyStagedData()
+        self.assertEqual(content.name, 'Roger')
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            required=(INameContent, None, None),
+            provided=interfaces.IStep, name='other')
+
+    def test_overridden_content_not_staged(self):
+        zope.component.provideAdapter(
+            AddressStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='address')
+        content = NameContent()
+        content.address = NameContent()
+        # a wizard without data store applies the changes
+        wiz = LinearWizard(content, TestRequest())
+        addressStep = wiz.publishTraverse(wiz.request, 'address')
+        addressStep.applyChanges({'name': 'Roger'})
+        self.assertEqual(content.address.name, 'Roger')
+        # a staging wizard applies the changes to the overridden content
+        wiz = self.getWizard(content)
+        addressStep = wiz.publishTraverse(wiz.request, 'address')
+        self.assertIs(addressStep.getContent(), content.address)
+        addressStep.applyChanges({'name': 'Other'})
+        self.assertEqual(content.address.name, 'Other')
+        self.assertEqual(addressStep.getStagedChanges(), {})
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            required=(INameContent, None, None),
+            provided=interfaces.IStep, name='address')
+
+
+class AddressStep(NameStep):
+    """Step editing another object than the context."""
+
+    def getContent(self):
+        return self.context.address
+
+
+class OtherNameStep(NameStep):
+    """Later step with the same field."""
+
+    weight = 2
+
+
+class CityStep(step.Step):
+    """Step with a required city field."""
+
+    fields = field.Fields(ICityContent)
+    weight = 1
+
+
+class TestCombinedStagedChanges(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(datamanager.DictionaryField)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        zope.component.provideAdapter(
+            CityStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='city')
+        self.events = []
+        zope.component.provideHandler(
+            self.events.append, (IObjectModifiedEvent,))
+
+    def tearDown(self):
+        gsm = zope.component.getGlobalSiteManager()
+        gsm.unregisterAdapter(
+            required=(INameContent, None, None),
+            provided=interfaces.IStep, name='city')
+        gsm.unregisterHandler(self.events.append, (IObjectModifiedEvent,))
+
+    def test_one_event_per_content(self):
+        content = NameContent()
+        request = TestRequest()
+        request.setPrincipal(Principal('combined'))
+        wiz = StagingWizard(content, request)
+        wiz.combineStagedChanges = True
+        wiz.publishTraverse(request, 'name').applyChanges({'name': 'Roger'})
+        wiz.publishTraverse(request, 'city').applyChanges({'city': 'Zurich'})
+        self.assertEqual((content.name, content.city), (None, None))
+        del self.events[:]
+        wiz.applyStagedData()
+        self.assertEqual((content.name, content.city), ('Roger', 'Zurich'))
+        self.assertEqual(len(self.events), 1)
+        event = self.events[0]
+        self.assertIs(event.object, content)
+        self.assertEqual(
+            sorted((desc.interface, desc.attributes)
+                   for desc in event.descriptions),
+            sorted([(ICityContent, ('city',)), (INameContent, ('name',))]))
+
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        setStubs()
+        self.collector = timing.TimingCollector(samples=10)
+        zope.component.provideUtility(self.collector)
+
+    def tearDown(self):
+        zope.component.getGlobalSiteManager().unregisterUtility(
+            self.collector)
+
+    def test_verifyObject(self):
+        self.assertTrue(
+            verifyObject(interfaces.ITimingCollector, self.collector))
+
+    def test_phases_recorded(self):
+        wiz = CountingWizard(ContentStub(), TestRequest())
+        wiz.__name__ = 'wizard'
+        wiz.updateActions = lambda: None
+        wiz.publishTraverse(wiz.request, 'first')
+        wiz.update()
+        report = self.collector.report()
+        self.assertEqual(
+            sorted(report['wizard']),
+            ['doAdjustStep', 'filterSteps', 'orderSteps', 'setUpSteps',
+             'updateActions'])
+        setUpSteps = report['wizard']['setUpSteps']
+        self.assertEqual(setUpSteps['count'], 1)
+        self.assertEqual(setUpSteps['p50'], setUpSteps['total'])
+        self.collector.reset()
+        self.assertEqual(self.collector.report(), {})
+
+    def test_disabled(self):
+        zope.component.getGlobalSiteManager().unregisterUtility(
+            self.collector)
+        wiz = CountingWizard(ContentStub(), TestRequest())
+        self.assertIs(wiz.timePhase('setUpSteps'), timing.noPhaseTimer)
+
+    def test_percentile(self):
+        self.assertIsNone(timing.percentile([], 0.5))
+        values = list(range(101))
+        self.assertEqual(timing.percentile(values, 0.5), 50)
+        self.assertEqual(timing.percentile(values, 0.99), 99)
+
+
+class SlowStep(step.Step):
+    """Step with slow checks."""
+
+    checkConcurrently = True
+    delay = 0.2
+
+    @property
+    def available(self):
+        time.sleep(self.delay)
+        return True
+
+    @property
+    def completed(self):
+        time.sleep(self.delay)
+        return True
+
+
+class SiteRecordingStep(SlowStep):
+    """Step recording the component site of its checks."""
+
+    delay = 0
+    sites = []
+
+    @property
+    def available(self):
+        self.sites.append(getSite())
+        return True
+
+
+class SiteStub:
+    """Component site using the global registry."""
+
+    def getSiteManager(self):
+        return zope.component.getGlobalSiteManager()
+
+
+class TestConcurrentChecks(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+        for name in ('first', 'second', 'last'):
+            zope.component.provideAdapter(
+                SlowStep, (IContentStub, None, None),
+                provides=interfaces.IStep, name=name)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            required=(IContentStub, None, None),
+            provided=interfaces.IStep, name='second')
+        setStubs()
+
+    def getWizard(self):
+        wiz = wizard.Wizard(ContentStub(), TestRequest())
+        wiz.checkExecutor = self.executor
+        return wiz
+
+    def test_concurrent(self):
+        wiz = self.getWizard()
+        start = time.monotonic()
+        self.assertEqual(len(wiz.steps), 3)
+        self.assertTrue(wiz.completed)
+        # three times two checks would take 1.2 seconds in sequence
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    def test_timeout_fallback(self):
+        wiz = self.getWizard()
+        wiz.checkTimeout = 0.05
+        wiz.availableFallback = True
+        self.assertEqual(len(wiz.steps), 3)
+        self.assertFalse(wiz.completed)
+        self.assertFalse(wiz.isStepCompleted(wiz.steps[0]))
+
+    def test_request_deadline(self):
+        wiz = self.getWizard()
+        wiz.checkTimeout = 0.05
+        wiz.availableFallback = True
+        self.assertEqual(len(wiz.steps), 3)
+        deadline = wiz.getCheckDeadline()
+        # the completed checks don't get a timeout of their own
+        self.assertFalse(wiz.completed)
+        self.assertEqual(wiz.getCheckDeadline(), deadline)
+        self.assertLess(time.monotonic(), deadline + 0.04)
+
+    def test_component_site(self):
+        zope.component.provideAdapter(
+            SiteRecordingStep, (IContentStub, None, None),
+            provides=interfaces.IStep, name='first')
+        SiteRecordingStep.sites = []
+        site = SiteStub()
+        setSite(site)
+        self.addCleanup(setSite)
+        self.assertEqual(len(self.getWizard().steps), 3)
+        self.assertEqual(SiteRecordingStep.sites, [site])
+
+    def test_sequential_without_executor(self):
+        wiz = wizard.Wizard(ContentStub(), TestRequest())
+        self.assertFalse(wiz.isConcurrentCheck(wiz.steps[0]))
+
+
+class CountingAvailableStep(step.Step):
+    """Step counting the available checks."""
+
+    availableCacheTTL = 60
+    checks = 0
+
+    @property
+    def available(self):
+        CountingAvailableStep.checks += 1
+        return True
+
+
+class TestAvailableCache(unittest.TestCase):
+
+    def setUp(self):
+        CountingAvailableStep.checks = 0
+        WizardTestClass.availableCache = LRUCache(10)
+        zope.component.provideAdapter(
+            CountingAvailableStep, (IContentStub, None, None),
+            provides=interfaces.IStep, name='first')
+
+    def tearDown(self):
+        del WizardTestClass.availableCache
+        setStubs()
+
+    def getWizard(self, principalId='roger'):
+        request = TestRequest()
+        request.setPrincipal(Principal(principalId))
+        return WizardTestClass(ContentStub(), request)
+
+    def test_reused_between_requests(self):
+        self.assertEqual(len(self.getWizard().steps), 2)
+        self.assertEqual(len(self.getWizard().steps), 2)
+        self.assertEqual(CountingAvailableStep.checks, 1)
+        # the default key contains the principal
+        self.getWizard('michael').steps
+        self.assertEqual(CountingAvailableStep.checks, 2)
+
+    def test_expired(self):
+        CountingAvailableStep.availableCacheTTL = 0
+        try:
+            self.getWizard().steps
+            self.getWizard().steps
+        finally:
+            CountingAvailableStep.availableCacheTTL = 60
+        self.assertEqual(CountingAvailableStep.checks, 2)
+
+
+def isBusiness(wizard):
+    wizard.evaluated.append('business')
+    return wizard.context.business
+
+
+class GraphStep(step.Step):
+    """Step of a step graph."""
+
+    @property
+    def available(self):
+        self.wizard.evaluated.append('available ' + self.__name__)
+        return self.__name__ not in self.context.unavailable
+
+
+class GraphWizard(WizardTestClass):
+    """Wizard following the step graph."""
+
+    useStepGraph = True
+
+    def __init__(self, context, request):
+        super().__init__(context, request)
+        self.evaluated = []
+
+
+class TestStepGraph(unittest.TestCase):
+
+    steps = {
+        'first': (('business', isBusiness), ('private', None)),
+        'business': (('last', None),),
+        'private': (('last', None),),
+        'last': (),
+        'unused': (('last', None),),
+    }
+
+    def setUp(self):
+        for name, successors in self.steps.items():
+            weight = -1 if name == 'first' else 0
+            zope.component.provideAdapter(
+                type('GraphStep', (GraphStep,), {
+                    'weight': weight, 'successors': successors}),
+                (IContentStub, None, None),
+                provides=interfaces.IStep, name=name)
+
+    def tearDown(self):
+        for name in ('business', 'private', 'unused'):
+            zope.component.getGlobalSiteManager().unregisterAdapter(
+                required=(IContentStub, None, None),
+                provided=interfaces.IStep, name=name)
+        setStubs()
+
+    def getWizard(self, business, unavailable=()):
+        content = ContentStub()
+        content.business = business
+        content.unavailable = unavailable
+        return GraphWizard(content, TestRequest())
+
+    def test_path(self):
+        wiz = self.getWizard(True)
+        self.assertEqual([step.__name__ for step in wiz.steps],
+                         ['first', 'business', 'last'])
+        # only the steps along the path get evaluated
+        self.assertEqual(wiz.evaluated, [
+            'available first', 'business', 'available business',
+            'available last'])
+        wiz.step.__name__ = 'business'
+        self.assertEqual(wiz.previousStepName, 'first')
+        self.assertEqual(wiz.nextStepName, 'last')
+        wiz = self.getWizard(False)
+        self.assertEqual([step.__name__ for step in wiz.steps],
+                         ['first', 'private', 'last'])
+
+    def test_path_changes_on_next(self):
+        wiz = self.getWizard(False)
+        wiz.steps
+        wiz.context.business = True
+        wiz.goToNext()
+        self.assertEqual(wiz.nextURL, '#/business')
+
+    def test_unavailable_successor(self):
+        wiz = self.getWizard(True, unavailable=('business',))
+        self.assertEqual([step.__name__ for step in wiz.steps],
+                         ['first', 'private', 'last'])
+
+    def test_unreachable_step(self):
+        wiz = self.getWizard(True)
+        self.assertRaises(NotFound, wiz.publishTraverse, wiz.request, 'unused')
+
+    def test_start_step(self):
+        wiz = self.getWizard(True)
+        wiz.startStepName = 'unused'
+        self.assertEqual([step.__name__ for step in wiz.steps],
+                         ['unused', 'last'])
+
+    def test_unavailable_start_step(self):
+        wiz = self.getWizard(True, unavailable=('unused',))
+        wiz.startStepName = 'unused'
+        self.assertEqual([step.__name__ for step in wiz.steps],
+                         ['first', 'business', 'last'])
+
+
+class RogerStep(step.Step):
+    """Step only available if the name is Roger."""
+
+    fields = field.Fields(ICityContent)
+    weight = 1
+
+    @property
+    def available(self):
+        return self.context.name == 'Roger'
+
+
+class LastCityStep(CityStep):
+    """City step after the roger step."""
+
+    weight = 2
+
+
+class LinearWizard(wizard.Wizard):
+    """Wizard filtering and ordering the steps."""
+
+    baseURL = 'http://127.0.0.1/wizard'
+
+
+class TestAvailableAfterChanges(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        zope.component.provideAdapter(
+            RogerStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='roger')
+        zope.component.provideAdapter(
+            LastCityStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='city')
+
+    def tearDown(self):
+        gsm = zope.component.getGlobalSiteManager()
+        for name in ('roger', 'city'):
+            gsm.unregisterAdapter(
+                required=(INameContent, None, None),
+                provided=interfaces.IStep, name=name)
+
+    def test_linear_steps(self):
+        wiz = LinearWizard(NameContent(), TestRequest())
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        self.assertEqual(wiz.nextStepName, 'city')
+        nameStep.applyChanges({'name': 'Roger'})
+        wiz.goToNext()
+        self.assertEqual(wiz.nextURL, 'http://127.0.0.1/wizard/roger')
+
+
+class SubmissionWizard(LinearWizard):
+    """Wizard answering duplicate submissions with the recorded outcome."""
+
+    submissionWait = 0.05
+
+
+class TestSubmissions(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+
+    def tearDown(self):
+        transaction.abort()
+
+    def getWizard(self, record, key='key'):
+        wiz = SubmissionWizard(
+            NameContent(), TestRequest(form={'wizard.submission': key}))
+        wiz.submissionRecord = record
+        wiz.publishTraverse(wiz.request, 'name')
+        return wiz
+
+    def test_pending_submission(self):
+        record = LRUCache(10)
+        first = self.getWizard(record)
+        self.assertFalse(first.replaySubmission())
+        # a duplicate doesn't execute the actions while the first is pending
+        duplicate = self.getWizard(record)
+        self.assertTrue(duplicate.replaySubmission())
+        self.assertEqual(duplicate.nextURL, 'http://127.0.0.1/wizard/name')
+        duplicate.recordSubmission()
+        first.nextURL = 'http://127.0.0.1/wizard/city'
+        first.recordSubmission()
+        # the outcome gets recorded after the commit
+        duplicate = self.getWizard(record)
+        self.assertTrue(duplicate.replaySubmission())
+        self.assertEqual(duplicate.nextURL, 'http://127.0.0.1/wizard/name')
+        transaction.commit()
+        duplicate = self.getWizard(record)
+        self.assertTrue(duplicate.replaySubmission())
+        self.assertEqual(duplicate.nextURL, 'http://127.0.0.1/wizard/city')
+
+    def test_waits_for_first_submission(self):
+        record = LRUCache(10)
+        first = self.getWizard(record)
+        self.assertFalse(first.replaySubmission())
+        duplicate = self.getWizard(record)
+        duplicate.submissionWait = 5
+        first.nextURL = 'http://127.0.0.1/wizard/city'
+
+        def commit():
+            first.recordSubmission()
+            transaction.commit()
+
+        timer = threading.Timer(0.05, commit)
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertTrue(duplicate.replaySubmission())
+        self.assertEqual(duplicate.nextURL, 'http://127.0.0.1/wizard/city')
+
+    def test_released_on_abort(self):
+        record = LRUCache(10)
+        first = self.getWizard(record)
+        self.assertFalse(first.replaySubmission())
+        first.nextURL = 'http://127.0.0.1/wizard/city'
+        first.recordSubmission()
+        # e.g. a conflict error, the publisher retries the request
+        transaction.abort()
+        self.assertNotIn('key', record)
+        self.assertFalse(self.getWizard(record).replaySubmission())
+
+    def test_released_without_outcome(self):
+        record = LRUCache(10)
+        first = self.getWizard(record)
+        self.assertFalse(first.replaySubmission())
+        # e.g. invalid data
+        first.recordSubmission()
+        self.assertNotIn('key', record)
+        self.assertFalse(self.getWizard(record).replaySubmission())
+
+
+class UpdateRecordingStep(NameStep):
+    """Step recording if it got updated as forward target."""
+
+    updatedForwarded = None
+    weight = 1
+
+    def update(self):
+        self.updatedForwarded = self.forwarded
+
+
+class ProtectedStep(UpdateRecordingStep):
+    """Step protected by a permission."""
+
+
+class ForwardingWizard(LinearWizard):
+    """Wizard forwarding to the next step."""
+
+    forwardSteps = True
+
+
+class TestForward(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        zope.component.provideAdapter(
+            UpdateRecordingStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='next')
+
+    def tearDown(self):
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            required=(INameContent, None, None),
+            provided=interfaces.IStep, name='next')
+
+    def getWizard(self):
+        wiz = ForwardingWizard(NameContent(), TestRequest())
+        wiz.publishTraverse(wiz.request, 'name')
+        wiz.nextURL = 'http://127.0.0.1/wizard/next'
+        return wiz
+
+    def test_updates_target(self):
+        wiz = self.getWizard()
+        target = wiz.forward()
+        self.assertIsInstance(target, UpdateRecordingStep)
+        self.assertTrue(target.updatedForwarded)
+        self.assertIsNone(wiz.nextURL)
+        self.assertEqual(wiz.request.response.getHeader('X-Wizard-URL'),
+                         'http://127.0.0.1/wizard/next')
+
+    def test_redirects_without_permission(self):
+        zope.component.provideAdapter(
+            ProtectedStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='next')
+        zope.security.checker.defineChecker(
+            ProtectedStep,
+            zope.security.checker.Checker({'__call__': 'zope.ManageContent'}))
+        self.addCleanup(zope.security.checker.undefineChecker, ProtectedStep)
+        wiz = self.getWizard()
+        with zope.security.testing.interaction('roger'):
+            self.assertIsNone(wiz.forward())
+        self.assertEqual(wiz.nextURL, 'http://127.0.0.1/wizard/next')
+
+
+class LegacyWizard:
+    """IWizard implementation without the newer wizard methods."""
+
+    nextURL = None
+    baseURL = 'http://127.0.0.1/wizard'
+    updated = False
+
+    def __init__(self):
+        self.actions = types.SimpleNamespace(execute=lambda: None)
+
+    def update(self):
+        self.updated = True
+
+
+class EmptyStep(step.Step):
+    """Step without fields."""
+
+    fields = field.Fields()
+
+
+class TestLegacyWizard(unittest.TestCase):
+
+    formAdapters = (
+        field.FieldWidgets,
+        button.ButtonActions,
+        datamanager.AttributeField,
+    )
+
+    def setUp(self):
+        for factory in self.formAdapters:
+            zope.component.provideAdapter(factory)
+        zope.component.provideAdapter(
+            button.ButtonAction, provides=IButtonAction)
+
+    def tearDown(self):
+        gsm = zope.component.getGlobalSiteManager()
+        for factory in self.formAdapters:
+            gsm.unregisterAdapter(factory)
+        gsm.unregisterAdapter(button.ButtonAction, provided=IButtonAction)
+
+    def test_update(self):
+        request = TestRequest()
+        zope.interface.alsoProvides(request, IFormLayer)
+        wiz = LegacyWizard()
+        emptyStep = EmptyStep(NameContent(), request, wiz)
+        emptyStep.__name__ = 'empty'
+        emptyStep.update()
+        self.assertTrue(wiz.updated)
+        self.assertIsNone(emptyStep.forwardedStep)
+
+    def test_applyChanges(self):
+        content = NameContent()
+        nameStep = NameStep(content, TestRequest(), LegacyWizard())
+        nameStep.__name__ = 'name'
+        self.assertIs(nameStep.getContent(), content)
+        nameStep.applyChanges({'name': 'Roger'})
+        self.assertEqual(content.name, 'Roger')
+
+
+class ConditionCountingStep(step.Step):
+    """Step counting the next button condition evaluations."""
+
+    conditions = 0
+
+    @property
+    def showNextButton(self):
+        ConditionCountingStep.conditions += 1
+        return True
+
+
+class TestWizardButtonActions(unittest.TestCase):
+
+    def setUp(self):
+        setStubs()
+        zope.component.provideAdapter(
+            button.ButtonAction, provides=IButtonAction)
+        ConditionCountingStep.conditions = 0
+
+    def tearDown(self):
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            button.ButtonAction, provided=IButtonAction)
+
+    def getWizard(self):
+        request = TestRequest()
+        zope.interface.alsoProvides(request, IFormLayer)
+        wiz = WizardTestClass(ContentStub(), request)
+        wiz.step = ConditionCountingStep(wiz.context, request, wiz)
+        wiz.step.__name__ = 'first'
+        return wiz
+
+    def test_partition(self):
+        wiz = self.getWizard()
+        wiz.updateActions()
+        actions = wiz.actions
+        # no back button for the first step
+        self.assertEqual(actions.backActions, ())
+        self.assertEqual([action.name for action in actions.forwardActions],
+                         ['form.buttons.next'])
+        self.assertEqual(actions.otherActions, ())
+        self.assertIs(actions.forwardActions, actions.forwardActions)
+        # the actions get reused on the next update
+        wiz.updateActions()
+        self.assertIs(wiz.actions, actions)
+
+    def test_memoized_conditions(self):
+        wiz = self.getWizard()
+        wiz.updateActions()
+        self.assertTrue(wiz.showNextButton)
+        self.assertTrue(wiz.showNextButton)
+        self.assertEqual(ConditionCountingStep.conditions, 1)
+        wiz.invalidateSteps()
+        self.assertTrue(wiz.showNextButton)
+        self.assertEqual(ConditionCountingStep.conditions, 2)
+
+
+class ProgressWizard(wizard.Wizard):
+    """Wizard keeping the progress in a signed token."""
+
+    baseURL = 'http://127.0.0.1/wizard'
+    progressTokenSecret = 'secret'
+    progressTokenCookie = True
+
+
+class IScheduleContent(zope.interface.Interface):
+
+    start = zope.schema.Date(title='Start', required=False)
+    price = zope.schema.Decimal(title='Price', required=False)
+    days = zope.schema.Set(
+        title='Days', required=False,
+        value_type=zope.schema.Choice(values=('mon', 'tue', 'wed')))
+
+
+@zope.interface.implementer(IScheduleContent)
+class ScheduleContent:
+    """Content providing a start date, a price and days."""
+
+    start = None
+    price = None
+    days = None
+
+
+class ScheduleStep(step.Step):
+    """Step with values not serializable as JSON."""
+
+    fields = field.Fields(IScheduleContent)
+
+
+class TestProgressToken(unittest.TestCase):
+
+    # widgets and converters used for keep the staged values in the token
+    formAdapters = (
+        text.TextFieldWidget,
+        select.CollectionSelectFieldWidget,
+        select.CollectionChoiceSelectFieldWidget,
+        term.CollectionTerms,
+        term.CollectionTermsVocabulary,
+        converter.FieldDataConverter,
+        converter.CollectionSequenceDataConverter,
+        converter.FieldWidgetDataConverter,
+        converter.DecimalDataConverter,
+        converter.DateDataConverter,
+    )
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(datamanager.DictionaryField)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        zope.component.provideAdapter(
+            CityStep, (ICityContent, None, None),
+            provides=interfaces.IStep, name='city')
+        zope.component.provideAdapter(
+            ScheduleStep, (IScheduleContent, None, None),
+            provides=interfaces.IStep, name='schedule')
+        for factory in self.formAdapters:
+            zope.component.provideAdapter(factory)
+
+    def tearDown(self):
+        gsm = zope.component.getGlobalSiteManager()
+        for factory in self.formAdapters:
+            gsm.unregisterAdapter(factory)
+        gsm.unregisterAdapter(
+            required=(ICityContent, None, None),
+            provided=interfaces.IStep, name='city')
+        gsm.unregisterAdapter(
+            required=(IScheduleContent, None, None),
+            provided=interfaces.IStep, name='schedule')
+
+    def getRequest(self, **kw):
+        request = TestRequest(**kw)
+        zope.interface.alsoProvides(request, IFormLayer)
+        return request
+
+    def test_token(self):
+        state = {'step': 'city', 'staged': {'name': {'name': 'Roger'}}}
+        for compress in (False, True):
+            token = progress.dumpToken(state, 'secret', compress)
+            self.assertEqual(progress.loadToken(token, 'secret'), state)
+            self.assertRaises(
+                progress.InvalidToken, progress.loadToken, token, 'other')
+            self.assertRaises(
+                progress.InvalidToken, progress.loadToken, token, 'secret',
+                maxAge=-1)
+        self.assertRaises(
+            progress.InvalidToken, progress.loadToken, 'invalid', 'secret')
+        token = progress.dumpToken(state, 'secret', scope='a')
+        self.assertEqual(
+            progress.loadToken(token, 'secret', scope='a'), state)
+        self.assertRaises(
+            progress.InvalidToken, progress.loadToken, token, 'secret',
+            scope='b')
+
+    def test_stateless_progress(self):
+        content = NameContent()
+        wiz = ProgressWizard(content, self.getRequest())
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        nameStep.applyChanges({'name': 'Roger'})
+        wiz.markProgressCompleted(nameStep)
+        wiz.goToNext()
+        self.assertEqual(wiz.nextURL, 'http://127.0.0.1/wizard/city')
+        token = wiz.progressToken
+        cookie = wiz.request.response.getCookie('wizard.progress')
+        self.assertEqual(cookie['path'], '/wizard')
+        scope = wiz.getProgressTokenScope()
+        self.assertEqual(
+            progress.loadToken(cookie['value'], 'secret', scope=scope),
+            progress.loadToken(token, 'secret', scope=scope))
+        self.assertIsNone(content.name)
+
+        # any worker can serve the next request
+        wiz = ProgressWizard(
+            content, self.getRequest(form={'wizard.progress': token}))
+        self.assertEqual(wiz.getDefaultStep().__name__, 'city')
+        self.assertEqual(wiz.stagedData, {'name': {'name': 'Roger'}})
+        wiz.publishTraverse(wiz.request, 'city')
+        self.assertTrue(wiz.isProgressCompleted(wiz.steps[0]))
+        self.assertFalse(wiz.doAdjustStep())
+        wiz.applyStagedData()
+        self.assertEqual(content.name, 'Roger')
+        self.assertEqual(wiz.progressState['completed'], 0)
+
+    def test_no_token_in_urls(self):
+        content = NameContent()
+        wiz = ProgressWizard(content, self.getRequest())
+        wiz.progressTokenCookie = False
+        nameStep = wiz.publishTraverse(wiz.request, 'name')
+        nameStep.applyChanges({'name': 'Roger'})
+        wiz.goToNext()
+        self.assertIsNone(wiz.request.response.getCookie('wizard.progress'))
+        # the staged values don't leak into logs or referrers
+        self.assertEqual(wiz.nextURL, 'http://127.0.0.1/wizard/city')
+        self.assertEqual([item['url'] for item in wiz.stepMenu],
+                         ['http://127.0.0.1/wizard/name',
+                          'http://127.0.0.1/wizard/city'])
+        # the form carries the token
+        wiz = ProgressWizard(
+            content,
+            self.getRequest(form={'wizard.progress': wiz.progressToken}))
+        self.assertEqual(wiz.getDefaultStep().__name__, 'city')
+        self.assertEqual(wiz.stagedData, {'name': {'name': 'Roger'}})
+
+    def test_token_of_other_wizard(self):
+        content = NameContent()
+        wiz = ProgressWizard(content, self.getRequest())
+        wiz.publishTraverse(wiz.request, 'name').applyChanges(
+            {'name': 'Roger'})
+        token = wiz.progressToken
+        other = ProgressWizard(
+            NameContent(), self.getRequest(form={'wizard.progress': token}))
+        other.baseURL = 'http://127.0.0.1/other/wizard'
+        self.assertEqual(other.progressState['staged'], {})
+        request = self.getRequest(form={'wizard.progress': token})
+        request.setPrincipal(Principal('michael'))
+        wiz = ProgressWizard(content, request)
+        self.assertEqual(wiz.progressState['staged'], {})
+
+    def test_staged_values(self):
+        data = {'start': datetime.date(2008, 5, 1),
+                'price': decimal.Decimal('12.50'),
+                'days': {'mon', 'tue'}}
+        wiz = ProgressWizard(ScheduleContent(), self.getRequest())
+        scheduleStep = wiz.publishTraverse(wiz.request, 'schedule')
+        scheduleStep.applyChanges(data)
+        token = wiz.progressToken
+        wiz = ProgressWizard(
+            ScheduleContent(),
+            self.getRequest(form={'wizard.progress': token}))
+        scheduleStep = wiz.publishTraverse(wiz.request, 'schedule')
+        self.assertEqual(scheduleStep.getContent(), data)
+
+    def test_tampered_token(self):
+        content = NameContent()
+        token = progress.dumpToken(
+            {'step': 'city', 'completed': 1}, 'other')
+        wiz = ProgressWizard(
+            content, self.getRequest(form={'wizard.progress': token}))
+        self.assertIsNone(wiz.progressState['step'])
+        self.assertFalse(wiz.isProgressCompleted(wiz.steps[0]))
+
+
+@validation.invariant('name', 'city')
+def nameIsNotCity(values):
+    nameIsNotCity.checks += 1
+    if values['name'] and values['name'] == values['city']:
+        raise zope.interface.Invalid('Name and city must differ.')
+
+
+class InvariantWizard(wizard.Wizard):
+    """Wizard with a cross-step invariant."""
+
+    baseURL = '#'
+    invariants = (nameIsNotCity,)
+
+
+class TestInvariants(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        zope.component.provideAdapter(
+            CityStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='city')
+        nameIsNotCity.checks = 0
+
+    def tearDown(self):
+        zope.component.getGlobalSiteManager().unregisterAdapter(
+            required=(INameContent, None, None),
+            provided=interfaces.IStep, name='city')
+
+    def test_invariant(self):
+        content = NameContent()
+        wiz = InvariantWizard(content, TestRequest())
+        self.assertEqual(
+            wiz.getInvariantValues(('name', 'city')),
+            {'name': None, 'city': None})
+        wiz.publishTraverse(wiz.request, 'name').applyChanges(
+            {'name': 'Zug'})
+        wiz.publishTraverse(wiz.request, 'city').applyChanges(
+            {'city': 'Zug'})
+        self.assertEqual([str(error) for error in wiz.invariantErrors],
+                         ['Name and city must differ.'])
+        self.assertFalse(wiz.completed)
+        # the result gets reused until a field of the invariant changes
+        wiz.invariantErrors
+        self.assertEqual(nameIsNotCity.checks, 1)
+        wiz.invalidateInvariants(['other'])
+        wiz.invariantErrors
+        self.assertEqual(nameIsNotCity.checks, 1)
+        wiz.step.applyChanges({'city': 'Zurich'})
+        self.assertEqual(wiz.invariantErrors, [])
+        self.assertEqual(nameIsNotCity.checks, 2)
+        self.assertTrue(wiz.completed)
+
+    def test_prefixed_fields(self):
+        zope.component.provideAdapter(
+            PrefixedNameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        content = NameContent()
+        content.name = content.city = 'Zug'
+        wiz = InvariantWizard(content, TestRequest())
+        self.assertEqual(len(wiz.invariantErrors), 1)
+        wiz.publishTraverse(wiz.request, 'name').applyChanges(
+            {'p.name': 'Roger'})
+        self.assertEqual(wiz.invariantErrors, [])
+        self.assertEqual(nameIsNotCity.checks, 2)
+
+    def test_stored_results(self):
+        zope.component.provideAdapter(AttributeAnnotations)
+        zope.component.provideHandler(
+            validation.updateInvariantResults, (IObjectModifiedEvent,))
+        self.addCleanup(
+            zope.component.getGlobalSiteManager().unregisterHandler,
+            validation.updateInvariantResults, (IObjectModifiedEvent,))
+        content = AnnotatableContent()
+        content.name = content.city = 'Zug'
+        wiz = BitmapInvariantWizard(content, TestRequest())
+        self.assertEqual(len(wiz.invariantErrors), 1)
+        wiz.storeInvariantResults()
+        self.assertEqual(
+            content.__annotations__[validation.ANNOTATION_KEY],
+            {'BitmapInvariantWizard': {'nameIsNotCity': (
+                ('city', 'name'), wiz.invariantErrors[0])}})
+        # the next request reuses the stored result
+        wiz = BitmapInvariantWizard(content, TestRequest())
+        self.assertEqual(len(wiz.invariantErrors), 1)
+        self.assertEqual(nameIsNotCity.checks, 1)
+        # the event forgets the results depending on the changed field
+        wiz.publishTraverse(wiz.request, 'city').applyChanges(
+            {'city': 'Zurich'})
+        self.assertEqual(
+            content.__annotations__[validation.ANNOTATION_KEY],
+            {'BitmapInvariantWizard': {}})
+        wiz = BitmapInvariantWizard(content, TestRequest())
+        self.assertEqual(wiz.invariantErrors, [])
+        self.assertEqual(nameIsNotCity.checks, 2)
+
+
+class BitmapInvariantWizard(InvariantWizard):
+    """Wizard storing the invariant results in the context."""
+
+    useCompletionBitmap = True
+
+
+@zope.interface.implementer(IAttributeAnnotatable)
+class AnnotatableContent(NameContent):
+    """Annotatable content."""
+
+
+class PrefixedNameStep(step.Step):
+    """Step with a prefixed name field."""
+
+    fields = field.Fields(INameContent, prefix='p')
+
+
+class SlowNameStep(NameStep):
+    """Step with a slow completed check."""
+
+    checkConcurrently = True
+
+    @property
+    def completed(self):
+        time.sleep(0.2)
+        return super().completed
+
+
+class BitmapWizard(wizard.Wizard):
+    """Wizard storing the completed states in the context."""
+
+    useCompletionBitmap = True
+
+
+class TestCompletionBitmap(unittest.TestCase):
+
+    def setUp(self):
+        zope.component.provideAdapter(datamanager.AttributeField)
+        zope.component.provideAdapter(AttributeAnnotations)
+        zope.component.provideAdapter(
+            NameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        zope.component.provideAdapter(
+            CityStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='city')
+        zope.component.provideHandler(
+            completion.updateCompletionBitmaps, (IObjectModifiedEvent,))
+
+    def tearDown(self):
+        gsm = zope.component.getGlobalSiteManager()
+        gsm.unregisterAdapter(
+            required=(INameContent, None, None),
+            provided=interfaces.IStep, name='city')
+        gsm.unregisterHandler(
+            completion.updateCompletionBitmaps, (IObjectModifiedEvent,))
+
+    def test_bitmap(self):
+        content = AnnotatableContent()
+        content.name = 'Roger'
+        wiz = BitmapWizard(content, TestRequest())
+        self.assertFalse(wiz.completed)
+        self.assertEqual(wiz.getDefaultStep().__name__, 'name')
+        # rendering doesn't write the context, doNext and doComplete do
+        self.assertFalse(hasattr(content, '__annotations__'))
+        wiz.storeBitmap()
+        bitmaps = content.__annotations__[completion.ANNOTATION_KEY]
+        checksum, known, completed, fields = bitmaps['BitmapWizard']
+        self.assertEqual((known, completed), (0b11, 0b01))
+        self.assertEqual(fields, {'name': 0b01, 'city': 0b10})
+
+        # the next request reads the bitmap, not the content
+        content.name = None
+        wiz = BitmapWizard(content, TestRequest())
+        wiz.firstStepAsDefault = False
+        self.assertEqual(wiz.getDefaultStep().__name__, 'city')
+
+        # the event forgets the state of the steps with the changed fields
+        zope.event.notify(ObjectModifiedEvent(
+            content, Attributes(INameContent, 'name')))
+        checksum, known, completed, fields = content.__annotations__[
+            completion.ANNOTATION_KEY]['BitmapWizard']
+        self.assertEqual((known, completed), (0b10, 0b00))
+        wiz = BitmapWizard(content, TestRequest())
+        wiz.firstStepAsDefault = False
+        self.assertEqual(wiz.getDefaultStep().__name__, 'name')
+
+    def test_prefixed_fields(self):
+        zope.component.provideAdapter(
+            PrefixedNameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        content = AnnotatableContent()
+        content.name = 'Roger'
+        wiz = BitmapWizard(content, TestRequest())
+        self.assertFalse(wiz.completed)
+        wiz.storeBitmap()
+        checksum, known, completed, fields = content.__annotations__[
+            completion.ANNOTATION_KEY]['BitmapWizard']
+        self.assertEqual((known, completed), (0b11, 0b01))
+        self.assertEqual(fields, {'p.name': 0b01, 'name': 0b01, 'city': 0b10})
+        wiz.publishTraverse(wiz.request, 'name').applyChanges(
+            {'p.name': 'Michael'})
+        checksum, known, completed, fields = content.__annotations__[
+            completion.ANNOTATION_KEY]['BitmapWizard']
+        self.assertEqual((known, completed), (0b10, 0b00))
+
+    def test_fallback_not_stored(self):
+        zope.component.provideAdapter(
+            SlowNameStep, (INameContent, None, None),
+            provides=interfaces.IStep, name='name')
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        content = AnnotatableContent()
+        content.name = 'Roger'
+        wiz = BitmapWizard(content, TestRequest())
+        wiz.checkExecutor = executor
+        wiz.checkTimeout = 0.05
+        self.assertFalse(wiz.completed)
+        self.assertFalse(wiz.isStepCompleted(wiz.steps[1]))
+        wiz.storeBitmap()
+        checksum, known, completed, fields = content.__annotations__[
+            completion.ANNOTATION_KEY]['BitmapWizard']
+        self.assertEqual((known, completed), (0b10, 0b00))
+
+    def test_changed_state_stored(self):
+        content = AnnotatableContent()
+        wiz = BitmapWizard(content, TestRequest())
+        self.assertFalse(wiz.completed)
+        # e.g. doNext of the name step
+        wiz.publishTraverse(wiz.request, 'name').applyChanges(
+            {'name': 'Roger'})
+        wiz.storeBitmap()
+        checksum, known, completed, fields = content.__annotations__[
+            completion.ANNOTATION_KEY]['BitmapWizard']
+        self.assertEqual((known, completed), (0b01, 0b01))
+
+    def test_not_annotatable(self):
+        wiz = BitmapWizard(NameContent(), TestRequest())
+        self.assertFalse(wiz.completed)
+        wiz.storeBitmap()
+
+
+class TestFunnel(unittest.TestCase):
+
+    def setUp(self):
+        setStubs()
+        self.sink = funnel.MemorySink()
+        self.recorder = funnel.FunnelRecorder(self.sink, size=4, flushSize=3)
+        zope.component.provideUtility(self.recorder)
+
+    def tearDown(self):
+        zope.component.getGlobalSiteManager().unregisterUtility(
+            self.recorder)
+
+    def test_verifyObject(self):
+        self.assertTrue(
+            verifyObject(interfaces.IFunnelRecorder, self.recorder))
+        self.assertTrue(verifyObject(interfaces.IFunnelSink, self.sink))
+
+    def test_ring_buffer(self):
+        self.recorder.flushSize = 100
+        for idx in range(6):
+            self.recorder.record('wizard', 'step%s' % idx, 'enter')
+        # the oldest events got dropped
+        self.assertEqual(self.recorder.flush(), 4)
+        self.assertEqual([event[2] for event in self.sink.events],
+                         ['step2', 'step3', 'step4', 'step5'])
+        self.assertEqual(self.recorder.flush(), 0)
+
+    def test_wizard_events(self):
+        request = TestRequest()
+        request.setPrincipal(Principal('roger'))
+        wiz = CountingWizard(ContentStub(), request)
+        wiz.__name__ = 'wizard'
+        wiz.publishTraverse(request, 'first')
+        wiz.recordFunnel('next')
+        self.assertEqual(len(self.sink.events), 0)
+        wiz.recordFunnel('invalid', 'last')
+        # flushed with the third event
+        self.assertEqual(
+            [event[1:] for event in self.sink.events],
+            [('wizard', 'first', 'enter', 'roger'),
+             ('wizard', 'first', 'next', 'roger'),
+             ('wizard', 'last', 'invalid', 'roger')])
+
+    def test_FileSink(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'funnel.jsonl')
+            sink = funnel.FileSink(path)
+            sink.write([(1.0, 'wizard', 'first', 'enter', None)])
+            sink.write([(2.0, 'wizard', 'first', 'next', None)])
+            with open(path) as f:
+                self.assertEqual(
+                    [json.loads(line) for line in f],
+                    [[1.0, 'wizard', 'first', 'enter', None],
+                     [2.0, 'wizard', 'first', 'next', None]])
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        data = benchmark.run(sizes=(2,), iterations=1)
+        self.assertEqual(
+            [(result['steps'], result['operation'])
+             for result in data['results']],
+            [(2, name) for name in benchmark.OPERATIONS])
+        self.assertEqual(data['results'][0]['iterations'], 1)
+        json.dumps(data)
+
+
 def test_suite():
     return unittest.TestSuite((
         doctest.DocFileSuite(
@@ -106,4 +1770,33 @@ def test_suite():
             optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS,),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestStep),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestWizard),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestWizardSteps),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestStepIndex),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestCompletionCache),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestStepInfo),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestDataManager),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestStepMenu),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestLRUCache),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestDataStore),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestStagedData),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestCombinedStagedChanges),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTiming),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestConcurrentChecks),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestAvailableCache),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestStepGraph),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestAvailableAfterChanges),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestSubmissions),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestForward),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestLegacyWizard),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestWizardButtonActions),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestProgressToken),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestInvariants),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestCompletionBitmap),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestFunnel),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestBenchmark),
     ))
@@ -0,0 +1,128 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Wizard phase timing.
+
+The timing is disabled by default. Register an ITimingCollector utility for
+enable it, e.g. the aggregating TimingCollector::
+
+  <utility factory="z3c.wizard.timing.TimingCollector" />
+"""
+__docformat__ = "reStructuredText"
+
+import collections
+import threading
+import time
+
+import zope.interface
+
+from z3c.wizard import interfaces
+
+
+class PhaseTimer:
+    """Context manager recording the duration of a wizard phase."""
+
+    __slots__ = ('collector', 'wizardName', 'phase', 'start')
+
+    def __init__(self, collector, wizardName, phase):
+        self.collector = collector
+        self.wizardName = wizardName
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.collector.record(
+            self.wizardName, self.phase, time.perf_counter() - self.start)
+
+
+class NoPhaseTimer:
+    """Context manager used if timing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+noPhaseTimer = NoPhaseTimer()
+
+
+def percentile(values, fraction):
+    """Return the percentile of the sorted values."""
+    if not values:
+        return None
+    idx = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[idx]
+
+
+class PhaseTimings:
+    """Count, total and the most recent samples of a phase."""
+
+    __slots__ = ('count', 'total', 'samples')
+
+    def __init__(self, size):
+        self.count = 0
+        self.total = 0.0
+        self.samples = collections.deque(maxlen=size)
+
+
+@zope.interface.implementer(interfaces.ITimingCollector)
+class TimingCollector:
+    """In-process collector aggregating the timings per wizard and phase.
+
+    The count and total cover all recorded timings, the percentiles get
+    computed from the most recent samples.
+    """
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def record(self, wizardName, phase, duration):
+        """See interfaces.ITimingCollector"""
+        key = (wizardName, phase)
+        with self._lock:
+            timings = self._timings.get(key)
+            if timings is None:
+                timings = self._timings[key] = PhaseTimings(self.samples)
+            timings.count += 1
+            timings.total += duration
+            timings.samples.append(duration)
+
+    def report(self):
+        """See interfaces.ITimingCollector"""
+        with self._lock:
+            items = [(key, timings.count, timings.total,
+                      sorted(timings.samples))
+                     for key, timings in self._timings.items()]
+        report = {}
+        for (wizardName, phase), count, total, samples in items:
+            report.setdefault(wizardName, {})[phase] = {
+                'count': count,
+                'total': total,
+                'p50': percentile(samples, 0.5),
+                'p99': percentile(samples, 0.99),
+            }
+        return report
+
+    def reset(self):
+        """See interfaces.ITimingCollector"""
+        with self._lock:
+            self._timings.clear()
@@ -0,0 +1,106 @@
+##############################################################################
+#
+# Copyright (c) 2008 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Cross-step invariants.
+
+Wizards using the completion bitmap store the invariant results as
+annotation of the wizard context. The annotation maps the wizard name to the
+(field names, error) tuples keyed by invariant name. The field names are the
+form and schema field names the invariant depends on.
+"""
+__docformat__ = "reStructuredText"
+
+import zope.interface
+from zope.annotation.interfaces import IAnnotations
+
+
+ANNOTATION_KEY = 'z3c.wizard.invariants'
+
+
+class Invariant:
+    """Invariant over fields of different wizard steps.
+
+    The check gets called with a dict of the field values keyed by the
+    schema field names and raises zope.interface.Invalid if the invariant
+    is violated.
+    """
+
+    def __init__(self, check, fields, name=None):
+        self.check = check
+        self.fields = tuple(fields)
+        self.__name__ = name or check.__name__
+
+    def validate(self, values):
+        """Return the Invalid error or None."""
+        try:
+            self.check(values)
+        except zope.interface.Invalid as error:
+            return error
+        return None
+
+    def __repr__(self):
+        return "<{} '{}'>".format(self.__class__.__name__, self.__name__)
+
+
+def invariant(*fields):
+    """Decorator making an Invariant depending on the given field names."""
+    def factory(check):
+        return Invariant(check, fields)
+    return factory
+
+
+def queryInvariantResults(content, wizardName):
+    """Return the stored errors or None keyed by invariant name.
+
+    Returns None if the content is not annotatable.
+    """
+    annotations = IAnnotations(content, None)
+    if annotations is None:
+        return None
+    results = annotations.get(ANNOTATION_KEY, {}).get(wizardName, {})
+    return {name: error for name, (fieldNames, error) in results.items()}
+
+
+def setInvariantResults(content, wizardName, results):
+    """Store the (field names, error) tuples keyed by invariant name."""
+    annotations = IAnnotations(content)
+    # store a new mapping, the annotations notice the change
+    stored = dict(annotations.get(ANNOTATION_KEY, {}))
+    wizardResults = dict(stored.get(wizardName, {}))
+    wizardResults.update(results)
+    stored[wizardName] = wizardResults
+    annotations[ANNOTATION_KEY] = stored
+
+
+def updateInvariantResults(event):
+    """Forget the invariant results depending on changed fields.
+
+    All results get forgotten if the event doesn't describe the changed
+    fields.
+    """
+    annotations = IAnnotations(event.object, None)
+    if annotations is None:
+        return
+    stored = annotations.get(ANNOTATION_KEY)
+    if not stored:
+        return
+    names = {name for description in event.descriptions
+             for name in getattr(description, 'attributes', ())}
+    changed = {}
+    for wizardName, results in stored.items():
+        kept = {name: result for name, result in results.items()
+                if names and not names.intersection(result[0])}
+        if len(kept) != len(results):
+            changed[wizardName] = kept
+    if changed:
+        annotations[ANNOTATION_KEY] = dict(stored, **changed)
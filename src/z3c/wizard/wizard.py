@@ -11,15 +11,48 @@
 # FOR A PARTICULAR PURPOSE.
 #
 ##############################################################################
+import concurrent.futures
+import functools
+import secrets
+import threading
+import time
+import types
+import urllib.parse
+import zlib
+
+import transaction
 import zope.component
 import zope.interface
+import zope.security.checker
 from z3c.form import button
+from z3c.form import form as z3cform
+from z3c.form.field import Fields
 from z3c.formui import form
+from zope.authentication.interfaces import IUnauthenticatedPrincipal
+from zope.component.hooks import getSite
+from zope.component.hooks import setSite
 from zope.publisher.interfaces import NotFound
+from zope.security.proxy import removeSecurityProxy
 from zope.traversing.browser import absoluteURL
 
 from z3c.wizard import interfaces
 from z3c.wizard.button import WizardButtonActions
+from z3c.wizard.cache import LRUCache
+from z3c.wizard.completion import queryCompletionBitmap
+from z3c.wizard.completion import setCompletionBitmap
+from z3c.wizard.manifest import stepManifest
+from z3c.wizard.progress import InvalidToken
+from z3c.wizard.progress import dumpToken
+from z3c.wizard.progress import loadToken
+from z3c.wizard.step import StepInfo
+from z3c.wizard.step import getSteps
+from z3c.wizard.step import invalidateCompleted
+from z3c.wizard.step import notifyModified
+from z3c.wizard.step import queryStepAttribute
+from z3c.wizard.timing import PhaseTimer
+from z3c.wizard.timing import noPhaseTimer
+from z3c.wizard.validation import queryInvariantResults
+from z3c.wizard.validation import setInvariantResults
 
 
 def nameStep(step, name):
@@ -28,6 +61,154 @@ def nameStep(step, name):
     return step
 
 
+def realStep(step):
+    """Return the step form of a step info or the given step."""
+    if isinstance(step, StepInfo):
+        return step.step
+    return step
+
+
+def emptyProgressState():
+    """Return the progress state without progress.
+
+    The completed bitmap refers to the step names with the steps checksum.
+    """
+    return {'step': None, 'completed': 0, 'steps': None, 'staged': {}}
+
+
+def getTargetValues(step):
+    """Return the target content values of the step keyed by schema name.
+
+    Missing values are left out.
+    """
+    values = {}
+    content = step.getTargetContent()
+    for name, field in step.fields.items():
+        dm = step.getDataManager(content, name, field.field)
+        value = dm.query(field.field.missing_value)
+        if value is not field.field.missing_value:
+            values[field.field.__name__] = value
+    return values
+
+
+def recordSubmissionOutcome(status, record, key, pending, nextURL, ttl):
+    """Record the redirect target of a committed submission.
+
+    Used as transaction hook, the key gets released if the transaction
+    did not commit. Wakes up the waiting duplicates.
+    """
+    if status:
+        record.set(key, nextURL, ttl)
+    else:
+        record.invalidate(key)
+    pending.set()
+
+
+def releaseSubmission(record, key, pending):
+    """Release the submission key and wake up the waiting duplicates."""
+    record.invalidate(key)
+    pending.set()
+
+
+def callInSite(site, check):
+    """Call the check with the component site of the submitting thread."""
+    previous = getSite()
+    setSite(site)
+    try:
+        return check()
+    finally:
+        setSite(previous)
+
+
+# marks a timed out check, see filterSteps
+_timedOut = object()
+
+
+class CompletionCache:
+    """Completion states of steps keyed on content identity and a step key.
+
+    The cache keeps a reference to the content while an entry exists. This
+    makes sure the content identity can't get reused during the lifetime of
+    the cache.
+    """
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, content, key, default=None):
+        content = removeSecurityProxy(content)
+        entry = self._data.get(id(content))
+        if entry is None:
+            return default
+        return entry[1].get(key, default)
+
+    def set(self, content, key, completed):
+        content = removeSecurityProxy(content)
+        entry = self._data.get(id(content))
+        if entry is None:
+            entry = self._data[id(content)] = (content, {})
+        entry[1][key] = completed
+
+    def invalidate(self, content=None):
+        """Forget the states of the given content or all states."""
+        if content is None:
+            self._data.clear()
+        else:
+            self._data.pop(id(removeSecurityProxy(content)), None)
+
+
+def applyCombinedChanges(steps):
+    """Apply the staged data of the steps at once per target content.
+
+    The staged data of all steps with the same target content get applied
+    with one applyChanges call followed by one ObjectModifiedEvent including
+    all changed attributes. If more than one step stages the same field, the
+    value of the later step wins.
+    """
+    targets = {}
+    wizard = None
+    for step in steps:
+        wizard = step.wizard
+        data = step.getStagedChanges()
+        if not data:
+            continue
+        content = step.getTargetContent()
+        target = targets.get(id(content))
+        if target is None:
+            target = targets[id(content)] = (content, {}, {})
+        fields, values = target[1], target[2]
+        for name, value in data.items():
+            fields.setdefault(name, step.fields[name])
+            values[name] = value
+    for content, fields, values in targets.values():
+        applyForm = types.SimpleNamespace(
+            fields=Fields(*fields.values()))
+        changes = z3cform.applyChanges(applyForm, content, values)
+        if changes:
+            notifyModified(content, changes)
+            invalidateCompleted(wizard, content)
+
+
+class StepIndex:
+    """Navigation index for an ordered list of steps.
+
+    The index knows the position of each step name and the first, last,
+    previous and next step names. This allows the wizard to navigate without
+    scanning the step list.
+    """
+
+    def __init__(self, steps):
+        self.names = names = tuple(step.__name__ for step in steps)
+        self.positions = {name: idx for idx, name in enumerate(names)}
+        self.first = names[0] if names else None
+        self.last = names[-1] if names else None
+        self.previous = dict(zip(names[1:], names[:-1]))
+        self.next = dict(zip(names[:-1], names[1:]))
+
+    def __len__(self):
+        return len(self.names)
+
+
 @zope.interface.implementer(interfaces.IWizard)
 class Wizard(form.Form):
     """Wizard form.
@@ -49,132 +230,872 @@ class Wizard(form.Form):
 
     firstStepAsDefault = True
     adjustStep = True
+    useStepManifest = False
+    # follow the step successors instead of filtering and ordering the steps
+    useStepGraph = False
+    startStepName = None  # defaults to the step with the lowest weight
     confirmationPageName = None
     nextURL = None
 
     cssActive = 'selected'
     cssInActive = None  # None will skip class attribute in DOM element
 
+    # set an LRUCache for share the step menu items between requests, the
+    # menu items get keyed on base URL, selected step and step names.
+    stepMenuCache = None
+
+    # render the next step in the same response instead of redirecting
+    forwardSteps = False
+    forwardURLHeader = 'X-Wizard-URL'
+
+    # evaluate the checks of steps with checkConcurrently set with this
+    # executor, e.g. a bounded concurrent.futures.ThreadPoolExecutor
+    checkExecutor = None
+    checkTimeout = None  # seconds per request
+    availableFallback = False
+    completedFallback = False
+
+    # available values of steps with availableCacheTTL set, shared by all
+    # wizards using this class
+    availableCache = LRUCache(10000)
+
+    # set an IWizardDataStore for stage the step data until doComplete
+    dataStore = None
+    # apply the staged data with one event per content instead of per step
+    combineStagedChanges = False
+
+    # keep the completed states of the steps editing the context in an
+    # annotation of the context, see z3c.wizard.completion
+    useCompletionBitmap = False
+
+    # cross-step Invariants validated for complete the wizard, see
+    # z3c.wizard.validation
+    invariants = ()
+
+    # set a secret for keep the current step, the completed steps and the
+    # staged data in a signed progress token instead of on the server. The
+    # token gets rendered as hidden field and optionally set as cookie.
+    progressTokenSecret = None
+    progressTokenName = 'wizard.progress'
+    progressTokenCookie = False
+    progressTokenCompress = False
+    progressTokenMaxAge = None  # seconds
+
+    # set an LRUCache for answer duplicate submissions with the redirect
+    # target of the first submission. The submission key gets rendered as
+    # hidden field.
+    submissionRecord = None
+    submissionKeyName = 'wizard.submission'
+    submissionTTL = None  # seconds
+    submissionWait = 5  # seconds a duplicate waits for the first submission
+
     # for internal use
     __name__ = None
     step = None
+    _steps = None
+    _stagedData = None
+    _stepData = None
+    _completedFallbacks = None
+    _bitmapPending = None
+    _submissionPending = None
+    _checkDeadline = None
+    _timingCollector = None
+    _funnelRecorder = None
+    _stepIndex = None
+    _completionCache = None
+    _buttonConditions = None
+    _progressState = None
+    _submissionKey = None
+    _invariantResults = None
+    _invariantPending = None
 
     @property
     def baseURL(self):
         return absoluteURL(self, self.request)
 
+    @property
+    def wizardName(self):
+        """Name used for timings, funnel events and completion bitmaps."""
+        return self.__name__ or self.__class__.__name__
+
     def setUpSteps(self):
         """Return a list of steps. This implementation uses IStep adapters.
 
         Take a look at the addStep method defined in step.py. This method
         allows you to setup steps directly in the method and offers an API for
         customized step setup.
+
+        The steps get returned as StepInfo if possible. Such a step info only
+        creates the step form if it get traversed or if an attribute which
+        is not a plain class attribute is needed.
+
+        If useStepManifest is set, the step names recorded by the wizardStep
+        directive get used instead of searching all step adapters. Note, steps
+        registered without the directive are not a part of the manifest.
         """
-        steps = list(zope.component.getAdapters(
-            (self.context, self.request, self), self.stepInterface))
-        return [nameStep(step, name) for name, step in steps]
+        if self.useStepManifest:
+            names = stepManifest.getStepNames(
+                self.context, self.request, self)
+            if names:
+                return getSteps(self, self.stepInterface, names)
+        return getSteps(self, self.stepInterface)
 
     def filterSteps(self, steps):
         """Make sure to only select available steps and we give a name."""
-        return [step for step in steps if step.available]
+        available = {}
+        concurrentSteps = []
+        for step in steps:
+            cached = self.getCachedAvailable(step)
+            if cached is not None:
+                available[id(step)] = cached
+            elif self.isConcurrentCheck(step):
+                concurrentSteps.append(step)
+        futures = self.submitChecks(
+            [functools.partial(getattr, realStep(step), 'available')
+             for step in concurrentSteps])
+        for step in steps:
+            if id(step) not in available and not self.isConcurrentCheck(step):
+                available[id(step)] = self.cacheAvailable(step, step.available)
+        results = self.collectChecks(futures, _timedOut)
+        for step, value in zip(concurrentSteps, results):
+            if value is _timedOut:
+                # don't cache the fallback
+                value = self.availableFallback
+            else:
+                value = self.cacheAvailable(step, value)
+            available[id(step)] = value
+        return [step for step in steps if available[id(step)]]
 
     def orderSteps(self, steps):
         # order steps by it's weight
         return sorted(steps, key=lambda step: step.weight)
 
+    def followSteps(self, steps):
+        """See interfaces.IWizard"""
+        if not steps:
+            return []
+        stepsByName = {step.__name__: step for step in steps}
+        # start with the first available step, the start step or by weight
+        candidates = sorted(steps, key=lambda step: step.weight)
+        start = stepsByName.get(self.startStepName)
+        if start is not None:
+            candidates.remove(start)
+            candidates.insert(0, start)
+        step = None
+        for candidate in candidates:
+            if self.isStepAvailable(candidate):
+                step = candidate
+                break
+        path = []
+        names = set()
+        # stop at the end of the path or if a step gets visited twice
+        while step is not None and step.__name__ not in names:
+            path.append(step)
+            names.add(step.__name__)
+            step = self.getSuccessor(step, stepsByName)
+        return path
+
+    def getSuccessor(self, step, stepsByName):
+        """See interfaces.IWizard"""
+        for name, condition in queryStepAttribute(step, 'successors') or ():
+            successor = stepsByName.get(name)
+            if successor is None:
+                continue
+            if ((condition is None or condition(self))
+                    and self.isStepAvailable(successor)):
+                return successor
+        return None
+
+    def isStepAvailable(self, step):
+        """Return the (cached) available value of the step."""
+        available = self.getCachedAvailable(step)
+        if available is None:
+            available = self.cacheAvailable(step, step.available)
+        return available
+
     @property
     def steps(self):
-        steps = self.setUpSteps()
-        steps = self.filterSteps(steps)
-        return self.orderSteps(steps)
+        """See interfaces.IWizard"""
+        if self._steps is None:
+            with self.timePhase('setUpSteps'):
+                steps = self.setUpSteps()
+            if self.useStepGraph:
+                with self.timePhase('followSteps'):
+                    steps = self.followSteps(steps)
+            else:
+                with self.timePhase('filterSteps'):
+                    steps = self.filterSteps(steps)
+                with self.timePhase('orderSteps'):
+                    steps = self.orderSteps(steps)
+            self._steps = steps
+            self._stepIndex = StepIndex(steps)
+        return self._steps
 
     @property
-    def completed(self):
+    def stepIndex(self):
+        """See interfaces.IWizard"""
+        if self._steps is None:
+            self.steps
+        return self._stepIndex
+
+    def invalidateSteps(self):
+        """See interfaces.IWizard"""
+        self._steps = None
+        self._stepIndex = None
+        self._buttonConditions = None
+        self._invariantResults = None
+
+    def timePhase(self, phase):
+        """See interfaces.IWizard"""
+        collector = self._timingCollector
+        if collector is None:
+            collector = self._timingCollector = zope.component.queryUtility(
+                interfaces.ITimingCollector, default=False)
+        if collector is False:
+            return noPhaseTimer
+        return PhaseTimer(collector, self.wizardName, phase)
+
+    def recordFunnel(self, event, stepName=None):
+        """See interfaces.IWizard"""
+        recorder = self._funnelRecorder
+        if recorder is None:
+            recorder = self._funnelRecorder = zope.component.queryUtility(
+                interfaces.IFunnelRecorder, default=False)
+        if recorder is False:
+            return
+        if stepName is None:
+            stepName = self.step.__name__ if self.step else None
+        principal = getattr(self.request, 'principal', None)
+        recorder.record(self.wizardName, stepName, event,
+                        principal.id if principal is not None else None)
+
+    def getDataStoreKey(self):
+        """See interfaces.IWizard
+
+        The default key is only available for authenticated principals, all
+        anonymous users share the same unauthenticated principal id. Use a
+        session or client id based key if anonymous users should be able to
+        stage data.
+        """
+        principal = getattr(self.request, 'principal', None)
+        if (self.dataStore is None or principal is None
+                or IUnauthenticatedPrincipal.providedBy(principal)):
+            return None
+        return '{}:{}'.format(principal.id, self.baseURL)
+
+    @property
+    def stagedData(self):
+        """See interfaces.IWizard"""
+        if self.progressTokenSecret is not None:
+            return self.progressState['staged']
+        if self._stagedData is None:
+            key = self.getDataStoreKey()
+            if key is None:
+                return None
+            self._stagedData = self.dataStore.load(key) or {}
+        return self._stagedData
+
+    def getStagedData(self, step):
+        """See interfaces.IWizard
+
+        A step without staged data gets a snapshot of the target content
+        values. The snapshot only gets staged if the step applies changes.
+        """
+        stagedData = self.stagedData
+        if stagedData is None:
+            return None
+        if self._stepData is None:
+            self._stepData = {}
+        data = self._stepData.get(step.__name__)
+        if data is None:
+            if step.__name__ not in stagedData:
+                data = getTargetValues(step)
+            elif self.progressTokenSecret is not None:
+                # the token keeps the widget values, see Step.dumpStagedData
+                data = step.loadStagedData(stagedData[step.__name__])
+            else:
+                data = stagedData[step.__name__]
+            self._stepData[step.__name__] = data
+        return data
+
+    def saveStagedData(self, step):
+        """See interfaces.IWizard"""
+        data = self.getStagedData(step)
+        if self.progressTokenSecret is not None:
+            self.progressState['staged'][step.__name__] = (
+                step.dumpStagedData(data))
+            self.saveProgressState()
+        else:
+            self.stagedData[step.__name__] = data
+            self.dataStore.save(self.getDataStoreKey(), self.stagedData)
+
+    def applyStagedData(self):
+        """See interfaces.IWizard"""
+        stagedData = self.stagedData
+        if stagedData is None:
+            return
+        steps = []
         for step in self.steps:
-            if not step.completed:
+            if step.__name__ in stagedData:
+                steps.append(realStep(step))
+        if self.combineStagedChanges:
+            applyCombinedChanges(steps)
+        else:
+            for step in steps:
+                step.applyStagedData()
+        if self.progressTokenSecret is not None:
+            self.resetProgressState()
+        else:
+            self.dataStore.remove(self.getDataStoreKey())
+            self._stagedData = None
+            self._stepData = None
+
+    @property
+    def progressState(self):
+        """See interfaces.IWizard"""
+        if self._progressState is None:
+            self._progressState = self.loadProgressState()
+        return self._progressState
+
+    def loadProgressState(self):
+        """Return the state of the progress token from the form or cookie.
+
+        A missing, invalid or expired token results in an empty state.
+        """
+        name = self.progressTokenName
+        token = self.request.form.get(name) or self.request.cookies.get(name)
+        state = emptyProgressState()
+        if token:
+            try:
+                state.update(loadToken(
+                    token, self.progressTokenSecret, self.progressTokenMaxAge,
+                    self.getProgressTokenScope()))
+            except (InvalidToken, TypeError, ValueError):
+                pass
+        return state
+
+    @property
+    def progressToken(self):
+        """See interfaces.IWizard"""
+        if self.progressTokenSecret is None:
+            return None
+        return dumpToken(self.progressState, self.progressTokenSecret,
+                         self.progressTokenCompress,
+                         self.getProgressTokenScope())
+
+    def getProgressTokenScope(self):
+        """Return the wizard URL and principal id the token is valid for.
+
+        A token of another wizard, context or principal gets rejected.
+        """
+        principal = getattr(self.request, 'principal', None)
+        principalId = principal.id if principal is not None else None
+        return '{}\n{}'.format(self.baseURL, principalId)
+
+    def getProgressCookiePath(self):
+        return urllib.parse.urlparse(self.baseURL).path or '/'
+
+    def saveProgressState(self):
+        """See interfaces.IWizard"""
+        if self.progressTokenCookie:
+            self.request.response.setCookie(
+                self.progressTokenName, self.progressToken,
+                path=self.getProgressCookiePath())
+
+    def resetProgressState(self):
+        """See interfaces.IWizard"""
+        self._progressState = emptyProgressState()
+        self._stepData = None
+        if self.progressTokenCookie:
+            self.request.response.expireCookie(
+                self.progressTokenName, path=self.getProgressCookiePath())
+
+    @property
+    def submissionKey(self):
+        """See interfaces.IWizard"""
+        if self.submissionRecord is None:
+            return None
+        if self._submissionKey is None:
+            self._submissionKey = secrets.token_urlsafe(16)
+        return self._submissionKey
+
+    def replaySubmission(self):
+        """See interfaces.IWizard
+
+        The first submission reserves the key with an event before the
+        actions get executed. A duplicate waits up to submissionWait seconds
+        for the event and gets redirected to the current step if the first
+        submission is still pending.
+        """
+        if self.submissionRecord is None:
+            return False
+        key = self.request.form.get(self.submissionKeyName)
+        if not key:
+            return False
+        record = self.submissionRecord
+        pending = threading.Event()
+        while True:
+            if record.add(key, pending, self.submissionTTL):
+                # first submission or the first one recorded no outcome
+                self._submissionPending = pending
                 return False
+            nextURL = record.get(key)
+            if isinstance(nextURL, threading.Event):
+                if nextURL.wait(self.submissionWait):
+                    # recorded or released, look again
+                    continue
+                # answer without executing the actions a second time
+                nextURL = self.getStepURL(self.step.__name__)
+            if nextURL is not None:
+                break
+        self.nextURL = nextURL
         return True
 
+    def recordSubmission(self):
+        """See interfaces.IWizard
+
+        The redirect target gets recorded after the transaction committed, a
+        retried or aborted transaction releases the submission key.
+        """
+        pending = self._submissionPending
+        if pending is None:
+            return
+        self._submissionPending = None
+        record = self.submissionRecord
+        key = self.request.form.get(self.submissionKeyName)
+        if self.nextURL is None:
+            # e.g. invalid data, the submission can get repeated
+            releaseSubmission(record, key, pending)
+            return
+        txn = transaction.get()
+        txn.addAfterCommitHook(
+            recordSubmissionOutcome,
+            (record, key, pending, self.nextURL, self.submissionTTL))
+        txn.addAfterAbortHook(releaseSubmission, (record, key, pending))
+
+    def getStepsChecksum(self):
+        """Return the checksum of the step names the bitmap refers to."""
+        names = '\n'.join(self.stepIndex.names).encode('utf-8')
+        return zlib.crc32(names)
+
+    def isProgressCompleted(self, step):
+        """See interfaces.IWizard"""
+        state = self.progressState
+        if state['steps'] != self.getStepsChecksum():
+            return False
+        position = self.stepIndex.positions.get(step.__name__)
+        return position is not None and bool(
+            state['completed'] >> position & 1)
+
+    def markProgressCompleted(self, step):
+        """See interfaces.IWizard"""
+        state = self.progressState
+        checksum = self.getStepsChecksum()
+        if state['steps'] != checksum:
+            state['steps'] = checksum
+            state['completed'] = 0
+        position = self.stepIndex.positions.get(step.__name__)
+        if position is not None:
+            state['completed'] |= 1 << position
+
+    @property
+    def completionCache(self):
+        """See interfaces.IWizard"""
+        if self._completionCache is None:
+            self._completionCache = CompletionCache()
+        return self._completionCache
+
+    def isStepCompleted(self, step):
+        """See interfaces.IWizard"""
+        if (self.progressTokenSecret is not None
+                and self.isProgressCompleted(step)):
+            # trust the signed progress token
+            return True
+        if self.useCompletionBitmap:
+            completed = self.queryBitmapCompleted(step)
+            if completed is not None:
+                return completed
+        key = step.getCompletedCacheKey()
+        if key is None:
+            return step.completed
+        content = step.getContent()
+        completed = self.completionCache.get(content, key)
+        if completed is None:
+            completed = bool(step.completed)
+            self.completionCache.set(content, key, completed)
+        if self.useCompletionBitmap:
+            # stored by storeBitmap, a rendering request doesn't write
+            if self._bitmapPending is None:
+                self._bitmapPending = set()
+            self._bitmapPending.add(step.__name__)
+        return completed
+
+    def getBitmapPosition(self, step):
+        """Return the bit position of the step or None."""
+        if self.stagedData is not None:
+            # the bitmap only knows the state of the context
+            return None
+        return self.stepIndex.positions.get(step.__name__)
+
+    def queryBitmapCompleted(self, step):
+        """See interfaces.IWizard"""
+        position = self.getBitmapPosition(step)
+        if position is None:
+            return None
+        bitmap = queryCompletionBitmap(
+            self.context, self.wizardName, self.getStepsChecksum())
+        if bitmap is None:
+            return None
+        known, completed, fields = bitmap
+        if not known >> position & 1:
+            return None
+        return bool(completed >> position & 1)
+
+    def storeBitmapCompleted(self, step, content, completed):
+        """See interfaces.IWizard"""
+        position = self.getBitmapPosition(step)
+        if (position is None or removeSecurityProxy(content)
+                is not removeSecurityProxy(self.context)):
+            # only the steps editing the context get stored
+            return
+        checksum = self.getStepsChecksum()
+        bitmap = queryCompletionBitmap(
+            self.context, self.wizardName, checksum)
+        if bitmap is None:
+            return
+        known, bits, fields = bitmap
+        bit = 1 << position
+        fields = dict(fields)
+        for name, field in realStep(step).fields.items():
+            # the events of the steps describe the form field names, other
+            # events usually the schema field names
+            for key in {name, field.field.__name__}:
+                fields[key] = fields.get(key, 0) | bit
+        bits = bits | bit if completed else bits & ~bit
+        setCompletionBitmap(self.context, self.wizardName,
+                            checksum, known | bit, bits, fields)
+
+    def storeBitmap(self):
+        """See interfaces.IWizard"""
+        if not self.useCompletionBitmap:
+            return
+        pending = self._bitmapPending or set()
+        if self.step is not None:
+            pending.add(self.step.__name__)
+        fallbacks = self._completedFallbacks or ()
+        for step in self.steps:
+            name = step.__name__
+            if (name not in pending or name in fallbacks
+                    or self.queryBitmapCompleted(step) is not None):
+                continue
+            # computed again if the changes invalidated the cached state
+            completed = self.isStepCompleted(step)
+            self.storeBitmapCompleted(step, step.getContent(), completed)
+        self._bitmapPending = None
+        self.storeInvariantResults()
+
+    def getCachedAvailable(self, step):
+        """See interfaces.IWizard"""
+        if not queryStepAttribute(step, 'availableCacheTTL'):
+            return None
+        return self.availableCache.get(step.getAvailableCacheKey())
+
+    def cacheAvailable(self, step, available):
+        """See interfaces.IWizard"""
+        available = bool(available)
+        ttl = queryStepAttribute(step, 'availableCacheTTL')
+        if ttl:
+            key = step.getAvailableCacheKey()
+            self.availableCache.set(key, available, ttl)
+        return available
+
+    def isConcurrentCheck(self, step):
+        """See interfaces.IWizard"""
+        if self.checkExecutor is None:
+            return False
+        return queryStepAttribute(step, 'checkConcurrently', False)
+
+    def submitChecks(self, checks):
+        """Submit the check callables to the check executor.
+
+        The checks get called with the current component site, the site is
+        local to the thread.
+        """
+        site = getSite()
+        return [self.checkExecutor.submit(callInSite, site, check)
+                for check in checks]
+
+    def getCheckDeadline(self):
+        """Return the time all checks of the request must be done or None.
+
+        The deadline starts with the first collected checks, the
+        checkTimeout applies to all checks of the request together.
+        """
+        if self.checkTimeout is None:
+            return None
+        if self._checkDeadline is None:
+            self._checkDeadline = time.monotonic() + self.checkTimeout
+        return self._checkDeadline
+
+    def collectChecks(self, futures, fallback):
+        """Return the check results or the fallback for timed out checks."""
+        deadline = self.getCheckDeadline()
+        results = []
+        for future in futures:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                results.append(future.result(timeout))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                results.append(fallback)
+        return results
+
+    def prefetchCompleted(self, steps):
+        """See interfaces.IWizard"""
+        pending = []
+        for step in steps:
+            if not self.isConcurrentCheck(step):
+                continue
+            key = step.getCompletedCacheKey()
+            if key is None:
+                continue
+            content = step.getContent()
+            if self.completionCache.get(content, key) is None:
+                pending.append((realStep(step), content, key))
+        if not pending:
+            return
+        futures = self.submitChecks(
+            [functools.partial(getattr, step, 'completed')
+             for step, content, key in pending])
+        results = self.collectChecks(futures, _timedOut)
+        for (step, content, key), completed in zip(pending, results):
+            if completed is _timedOut:
+                # the fallback is only valid for this request
+                completed = self.completedFallback
+                if self._completedFallbacks is None:
+                    self._completedFallbacks = set()
+                self._completedFallbacks.add(step.__name__)
+            self.completionCache.set(content, key, bool(completed))
+
+    @property
+    def completed(self):
+        self.prefetchCompleted(self.steps)
+        for step in self.steps:
+            if not self.isStepCompleted(step):
+                return False
+        return not self.invariantErrors
+
+    def getInvariantValues(self, fieldNames):
+        """See interfaces.IWizard"""
+        values = {}
+        missing = set(fieldNames)
+        for step in self.steps:
+            if not missing:
+                break
+            step = realStep(step)
+            content = None
+            for name, field in step.fields.items():
+                fieldName = field.field.__name__
+                if fieldName not in missing:
+                    continue
+                if content is None:
+                    content = step.getContent()
+                dm = step.getDataManager(content, name, field.field)
+                values[fieldName] = dm.query(field.field.missing_value)
+                missing.discard(fieldName)
+        return values
+
+    @property
+    def invariantErrors(self):
+        """See interfaces.IWizard"""
+        if not self.invariants:
+            return []
+        if self._invariantResults is None:
+            self._invariantResults = self.loadInvariantResults()
+        results = self._invariantResults
+        errors = []
+        for invariant in self.invariants:
+            if invariant not in results:
+                values = self.getInvariantValues(invariant.fields)
+                results[invariant] = invariant.validate(values)
+                if self._invariantPending is None:
+                    self._invariantPending = set()
+                self._invariantPending.add(invariant)
+            if results[invariant] is not None:
+                errors.append(results[invariant])
+        return errors
+
+    def canStoreInvariants(self):
+        """Return True if the invariant results get stored in the context."""
+        # staged values are not the values of the context
+        return self.useCompletionBitmap and self.stagedData is None
+
+    def loadInvariantResults(self):
+        """Return the stored invariant results keyed by invariant."""
+        if not self.canStoreInvariants():
+            return {}
+        stored = queryInvariantResults(self.context, self.wizardName)
+        if not stored:
+            return {}
+        return {invariant: stored[invariant.__name__]
+                for invariant in self.invariants
+                if invariant.__name__ in stored}
+
+    def getInvariantFieldNames(self, fieldNames):
+        """Return the form and schema names of the fields.
+
+        Returns None if a field belongs to a step not editing the context,
+        the subscriber of the context events doesn't notice its changes.
+        """
+        names = set(fieldNames)
+        for step in self.steps:
+            step = realStep(step)
+            content = None
+            for name, field in step.fields.items():
+                if field.field.__name__ not in names:
+                    continue
+                if content is None:
+                    content = step.getContent()
+                if (removeSecurityProxy(content)
+                        is not removeSecurityProxy(self.context)):
+                    return None
+                names.add(name)
+        return tuple(sorted(names))
+
+    def storeInvariantResults(self):
+        """See interfaces.IWizard"""
+        pending = self._invariantPending
+        self._invariantPending = None
+        if not pending or not self.canStoreInvariants():
+            return
+        results = {}
+        for invariant, error in (self._invariantResults or {}).items():
+            if invariant not in pending:
+                continue
+            names = self.getInvariantFieldNames(invariant.fields)
+            if names is not None:
+                results[invariant.__name__] = (names, error)
+        if results and queryInvariantResults(
+                self.context, self.wizardName) is not None:
+            setInvariantResults(self.context, self.wizardName, results)
+
+    def invalidateInvariants(self, fieldNames=None):
+        """See interfaces.IWizard"""
+        if self._invariantResults is None:
+            return
+        if fieldNames is None:
+            self._invariantResults = None
+            return
+        fieldNames = set(fieldNames)
+        for invariant in list(self._invariantResults):
+            if fieldNames.intersection(invariant.fields):
+                del self._invariantResults[invariant]
+
     @property
     def isFirstStep(self):
         """See interfaces.IWizard"""
-        return self.step and self.step.__name__ == self.steps[0].__name__
+        return self.step and self.step.__name__ == self.stepIndex.first
 
     @property
     def isLastStep(self):
         """See interfaces.IWizard"""
-        return self.step and self.step.__name__ == self.steps[-1].__name__
+        return self.step and self.step.__name__ == self.stepIndex.last
+
+    def getButtonCondition(self, name):
+        """See interfaces.IWizard"""
+        if not self.step:
+            return self.step
+        key = (self.step.__name__, name)
+        if self._buttonConditions is None:
+            self._buttonConditions = {}
+        try:
+            return self._buttonConditions[key]
+        except KeyError:
+            value = self._buttonConditions[key] = getattr(self.step, name)
+            return value
 
     @property
     def showBackButton(self):
         """Ask the step."""
-        return self.step and self.step.showBackButton
+        return self.getButtonCondition('showBackButton')
 
     @property
     def showNextButton(self):
         """Ask the step."""
-        return self.step and self.step.showNextButton
+        return self.getButtonCondition('showNextButton')
 
     @property
     def showCompleteButton(self):
         """Ask the step."""
-        return self.step.showCompleteButton
+        return self.getButtonCondition('showCompleteButton')
 
     @property
     def previousStepName(self):
         if self.step is None:
             return
-        stepNames = [step.__name__ for step in self.steps]
-        idx = stepNames.index(self.step.__name__)
-        if idx == 0:
-            return
-        return stepNames[idx - 1]
+        return self.stepIndex.previous.get(self.step.__name__)
 
     @property
     def nextStepName(self):
         if self.step is None:
             return
-        stepNames = [step.__name__ for step in self.steps]
-        idx = stepNames.index(self.step.__name__)
-        if idx == len(stepNames) - 1:
-            return
-        return stepNames[idx + 1]
+        return self.stepIndex.next.get(self.step.__name__)
 
     @property
     def stepMenu(self):
+        """See interfaces.IWizard"""
+        selected = self.step.__name__ if self.step is not None else None
+        if self.stepMenuCache is None:
+            return self.buildStepMenu(self.steps, selected, self.baseURL)
+        baseURL = self.baseURL
+        key = (baseURL, selected, self.stepIndex.names)
+        items = self.stepMenuCache.get(key)
+        if items is None:
+            items = tuple(self.buildStepMenu(self.steps, selected, baseURL))
+            self.stepMenuCache.set(key, items)
+        return list(items)
+
+    def buildStepMenu(self, steps, selected, baseURL):
+        """Build the step menu items in one pass over the steps."""
         items = []
         append = items.append
-        lenght = len(self.steps) - 1
-        for idx, step in enumerate(self.steps):
-            firstStep = False
-            lastStep = False
-            if step.visible:
-                isSelected = self.step and self.step.__name__ == step.__name__
-                cssClass = isSelected and self.cssActive or self.cssInActive
-                if idx == 0:
-                    firstStep = True
-                if idx == lenght:
-                    lastStep = True
-                append({
-                    'name': step.__name__,
-                    'title': step.label,
-                    'number': str(idx + 1),
-                    'url': '{}/{}'.format(self.baseURL, step.__name__),
-                    'selected': self.step.__name__ == step.__name__,
-                    'class': cssClass,
-                    'first': firstStep,
-                    'last': lastStep
-                })
+        last = len(steps) - 1
+        cssActive = self.cssActive
+        cssInActive = self.cssInActive
+        for idx, step in enumerate(steps):
+            if not step.visible:
+                continue
+            name = step.__name__
+            isSelected = name == selected
+            append({
+                'name': name,
+                'title': step.label,
+                'number': str(idx + 1),
+                'url': self.getStepURL(name, baseURL),
+                'selected': isSelected,
+                'class': cssActive if isSelected else cssInActive,
+                'first': idx == 0,
+                'last': idx == last,
+            })
         return items
 
     def getDefaultStep(self):
         """Can return the first or first not completed step as default."""
+        # return the current step of the progress token
+        if self.progressTokenSecret is not None:
+            position = self.stepIndex.positions.get(
+                self.progressState['step'])
+            if position is not None:
+                return self.steps[position]
         # return first step if this option is set
         if self.firstStepAsDefault:
             return self.steps[0]
         # return first not completed step
+        self.prefetchCompleted(self.steps)
         for step in self.steps:
-            if not step.completed:
+            if not self.isStepCompleted(step):
                 return step
         # fallback to first step if all steps completed
         return self.steps[0]
@@ -184,24 +1105,32 @@ class Wizard(form.Form):
         # last incomplete step
         if not self.adjustStep:
             return False
-        for step in self.steps:
-            if step.__name__ is self.step.__name__:
-                break
-            if not step.completed:
+        steps = self.steps
+        position = self.stepIndex.positions.get(
+            self.step.__name__, len(steps))
+        self.prefetchCompleted(steps[:position])
+        for step in steps[:position]:
+            if not self.isStepCompleted(step):
                 # prepare redirect to not completed step and return True
-                self.nextURL = '{}/{}'.format(self.baseURL, step.__name__)
+                self.nextURL = self.getStepURL(step.__name__)
                 return True
         # or return False
         return False
 
     def updateActions(self):
-        self.actions = WizardButtonActions(self, self.request, self.context)
+        # reuse the actions if the wizard gets updated more then once
+        if self.actions is None:
+            self.actions = WizardButtonActions(
+                self, self.request, self.context)
         self.actions.update()
 
     def update(self):
-        if self.doAdjustStep():
+        with self.timePhase('doAdjustStep'):
+            adjusted = self.doAdjustStep()
+        if adjusted:
             return
-        self.updateActions()
+        with self.timePhase('updateActions'):
+            self.updateActions()
 
     def publishTraverse(self, request, name):
         """Traverse to step by it's name."""
@@ -211,11 +1140,12 @@ class Wizard(form.Form):
         else:
             rawName = name
         # Find the active step
-        for step in self.steps:
-            if step.__name__ == rawName:
-                self.step = step
-                return self.step
-        raise NotFound(self, name, request)
+        position = self.stepIndex.positions.get(rawName)
+        if position is None:
+            raise NotFound(self, name, request)
+        self.step = realStep(self.steps[position])
+        self.recordFunnel('enter')
+        return self.step
 
     def browserDefault(self, request):
         """The default step is our browserDefault traversal setp."""
@@ -224,28 +1154,90 @@ class Wizard(form.Form):
         # always return default step as default view for our wizard
         return self, (step.__name__,)
 
+    def forward(self):
+        """See interfaces.IWizard"""
+        if not self.forwardSteps or self.nextURL is None:
+            return None
+        url = self.nextURL
+        prefix = self.baseURL + '/'
+        if not url.startswith(prefix):
+            return None
+        name = url[len(prefix):]
+        # setup the steps again like a new request would do
+        self.invalidateSteps()
+        if name not in self.stepIndex.positions:
+            return None
+        step = self.publishTraverse(self.request, name)
+        checker = zope.security.checker.getCheckerForInstancesOf(type(step))
+        if (checker is not None
+                and not zope.security.checker.canAccess(step, '__call__')):
+            # the publisher would check the permission of the target step,
+            # let the redirected request do it
+            return None
+        self.nextURL = None
+        step.updateForwarded()
+        if self.nextURL is not None:
+            # the target step redirects, e.g. by doAdjustStep
+            return None
+        self.request.response.setHeader(self.forwardURLHeader, url)
+        return step
+
+    def getStepURL(self, stepName, baseURL=None):
+        """See interfaces.IWizard
+
+        The URL never carries the progress token, the staged values must not
+        show up in logs or referrers. The cookie, the form or the JSON client
+        carry the token.
+        """
+        if baseURL is None:
+            baseURL = self.baseURL
+        return '{}/{}'.format(baseURL, stepName)
+
     def goToStep(self, stepName):
-        self.nextURL = '{}/{}'.format(self.baseURL, stepName)
+        if self.progressTokenSecret is not None:
+            self.progressState['step'] = stepName
+            self.saveProgressState()
+        self.nextURL = self.getStepURL(stepName)
 
     def goToBack(self):
         # redirect to next step if previous get sucessfuly processed
+        # the applied changes can change the available steps and the path
+        self.invalidateSteps()
         self.goToStep(self.previousStepName)
 
     def goToNext(self):
         # redirect to next step if previous get sucessfuly processed
+        # the applied changes can change the available steps and the path
+        self.invalidateSteps()
         self.goToStep(self.nextStepName)
 
     def doBack(self, action):
-        if self.step.doBack(action):
+        success = self.step.doBack(action)
+        # the applied changes can change the button conditions
+        self._buttonConditions = None
+        if success:
+            self.recordFunnel('back')
             self.goToBack()
 
     def doNext(self, action):
-        if self.step.doNext(action):
+        success = self.step.doNext(action)
+        self._buttonConditions = None
+        if success:
+            self.recordFunnel('next')
+            if (self.progressTokenSecret is not None
+                    and self.isStepCompleted(self.step)):
+                self.markProgressCompleted(self.step)
+            self.storeBitmap()
             self.goToNext()
 
     def doComplete(self, action):
-        if self.step.doComplete(action):
-            # do finsih after step get completed is completed
+        success = self.step.doComplete(action)
+        self._buttonConditions = None
+        if success and not self.invariantErrors:
+            self.recordFunnel('complete')
+            # apply the staged data and do finish after step get completed
+            self.applyStagedData()
+            self.storeBitmap()
             self.doFinish()
 
     def doFinish(self):
@@ -11,6 +11,9 @@
 # FOR A PARTICULAR PURPOSE.
 #
 ##############################################################################
+import functools
+import re
+
 import z3c.pagelet.zcml
 import zope.component
 import zope.configuration.fields
@@ -28,6 +31,7 @@ from zope.publisher.interfaces.browser import IDefaultBrowserLayer
 from z3c.wizard import interfaces
 from z3c.wizard import step
 from z3c.wizard import wizard
+from z3c.wizard.manifest import stepManifest
 
 
 class IWizardDirective(z3c.pagelet.zcml.IPageletDirective):
@@ -111,6 +115,52 @@ class IWizardStepDirective(zope.interface.Interface):
         value_type=zope.configuration.fields.PythonIdentifier())
 
 
+class IWizardStepsDirective(zope.interface.Interface):
+    """A directive to register many steps of a wizard at once.
+
+    Each step entry contains a name, a class and an optional weight and
+    permission. The entries get separated by commas or new lines, e.g.::
+
+      first .step.FirstStep, second .step.SecondStep 10 zope.ManageContent
+
+    Empty entries and entries starting with # get skipped.
+    """
+
+    steps = zope.schema.Text(
+        title="Steps",
+        description="The comma separated step entries.",
+        required=False)
+
+    manifest = zope.configuration.fields.Path(
+        title="Manifest",
+        description="A file containing one step entry per line.",
+        required=False)
+
+    permission = zope.security.zcml.Permission(
+        title="Permission",
+        description="The permission of the steps without a permission.",
+        required=True)
+
+    for_ = zope.configuration.fields.GlobalObject(
+        title="Context",
+        description="The content interface or class the steps are for.",
+        required=False)
+
+    layer = zope.configuration.fields.GlobalInterface(
+        title="The layer the steps are in.",
+        required=False)
+
+    wizard = zope.configuration.fields.GlobalObject(
+        title="Wizard",
+        description="The wizard interface or class the steps are for.",
+        required=False)
+
+    provides = zope.configuration.fields.GlobalInterface(
+        title="The interface the steps provide.",
+        required=False,
+        default=interfaces.IStep)
+
+
 # Arbitrary keys and values are allowed to be passed to the wizard.
 IWizardDirective.setTaggedValue('keyword_arguments', True)
 
@@ -119,35 +169,43 @@ IWizardDirective.setTaggedValue('keyword_arguments', True)
 IWizardStepDirective.setTaggedValue('keyword_arguments', True)
 
 
-# wizard directive
-def wizardDirective(
-        _context, class_, name, permission, for_=zope.interface.Interface,
-        layer=IDefaultBrowserLayer, provides=interfaces.IWizard,
-        allowed_interface=None, allowed_attributes=None, **kwargs):
+# generated classes keyed by the directive inputs, see getDirectiveClass
+_directiveClasses = {}
 
-    # Security map dictionary
-    required = {}
 
-    # Get the permission; mainly to correctly handle CheckerPublic.
-    permission = _handle_permission(_context, permission)
+@functools.lru_cache(maxsize=None)
+def extendsInterface(provides, iface):
+    """Return True if the provides interface is or extends the interface."""
+    return iface in zope.interface.Declaration(provides).flattened()
 
-    # The class must be specified.
-    if not class_:
-        raise ConfigurationError("Must specify a class.")
 
-    if not zope.interface.interfaces.IInterface.providedBy(provides):
-        raise ConfigurationError("Provides interface provide IInterface.")
+def getDirectiveClass(_context, class_, base, name, permission, provides,
+                      allowed_interface, allowed_attributes, kwargs):
+    """Return the generated class and create its security checker.
 
-    ifaces = list(zope.interface.Declaration(provides).flattened())
-    if interfaces.IWizard not in ifaces:
-        raise ConfigurationError("Provides interface must inherit IWizard.")
+    Directives with identical class, permission and attributes share one
+    generated class and checker.
+    """
+    key = (class_, base, name, permission, provides,
+           tuple(allowed_interface or ()), tuple(allowed_attributes or ()),
+           tuple(sorted(kwargs.items())))
+    try:
+        new_class = _directiveClasses.get(key)
+    except TypeError:
+        # unhashable keyword argument values
+        key = new_class = None
+    if new_class is not None:
+        return new_class
+
+    # Security map dictionary
+    required = {}
 
     # Build a new class that we can use different permission settings if we
     # use the class more then once.
     cdict = {}
     cdict['__name__'] = name
     cdict.update(kwargs)
-    new_class = type(class_.__name__, (class_, wizard.Wizard), cdict)
+    new_class = type(class_.__name__, (class_, base), cdict)
 
     # Set up permission mapping for various accessible attributes
     _handle_allowed_interface(
@@ -160,9 +218,6 @@ def wizardDirective(
         _context, ('__call__', 'browserDefault', 'update', 'render',
                    'publishTraverse'), permission, required)
 
-    # Register the interfaces.
-    _handle_for(_context, for_)
-
     # provide the custom provides interface if not allready provided
     if not provides.implementedBy(new_class):
         zope.interface.classImplements(new_class, provides)
@@ -171,6 +226,96 @@ def wizardDirective(
     zope.security.checker.defineChecker(
         new_class, zope.security.checker.Checker(required))
 
+    if key is not None:
+        _directiveClasses[key] = new_class
+    return new_class
+
+
+def registerWizardStep(factory, for_, layer, wizard, provides, name, info):
+    """Register the step adapter and record the step in the step manifest."""
+    zope.component.zcml.handler('registerAdapter', factory,
+                                (for_, layer, wizard), provides, name, info)
+    stepManifest.addStep(for_, layer, wizard, name,
+                         step.getStaticAttribute(factory, 'weight', 0))
+
+
+def registerWizardSteps(factories, for_, layer, wizard, provides, info):
+    """Register the (name, factory) steps, see registerWizardStep."""
+    for name, factory in factories:
+        registerWizardStep(factory, for_, layer, wizard, provides, name, info)
+
+
+def parseStepEntries(text):
+    """Return the (name, class name, weight, permission) of the step entries.
+
+    The weight and the permission are None if not given.
+    """
+    steps = []
+    for entry in re.split('[,\n]', text):
+        entry = entry.strip()
+        if not entry or entry.startswith('#'):
+            continue
+        parts = entry.split()
+        if not 2 <= len(parts) <= 4:
+            raise ConfigurationError(
+                "Step entry must contain a name, a class and an optional"
+                " weight and permission: %r" % entry)
+        name, className = parts[:2]
+        weight = permission = None
+        if len(parts) > 2:
+            try:
+                weight = int(parts[2])
+            except ValueError:
+                raise ConfigurationError(
+                    "Step entry has an invalid weight: %r" % entry)
+        if len(parts) > 3:
+            permission = parts[3]
+        steps.append((name, className, weight, permission))
+    return steps
+
+
+def _checkStepDirective(provides, wizard):
+    if not zope.interface.interfaces.IInterface.providedBy(provides):
+        raise ConfigurationError("Provides interface provide IInterface.")
+
+    if not extendsInterface(provides, interfaces.IPagelet):
+        raise ConfigurationError("Provides interface must inherit IPagelet.")
+
+    if zope.interface.interfaces.IInterface.providedBy(wizard):
+        # e.g. the default IWizard
+        valid = extendsInterface(wizard, interfaces.IWizard)
+    else:
+        valid = interfaces.IWizard.implementedBy(wizard)
+    if not valid:
+        raise ConfigurationError("Provides interface must inherit IWizard.")
+
+
+# wizard directive
+def wizardDirective(
+        _context, class_, name, permission, for_=zope.interface.Interface,
+        layer=IDefaultBrowserLayer, provides=interfaces.IWizard,
+        allowed_interface=None, allowed_attributes=None, **kwargs):
+
+    # Get the permission; mainly to correctly handle CheckerPublic.
+    permission = _handle_permission(_context, permission)
+
+    # The class must be specified.
+    if not class_:
+        raise ConfigurationError("Must specify a class.")
+
+    if not zope.interface.interfaces.IInterface.providedBy(provides):
+        raise ConfigurationError("Provides interface provide IInterface.")
+
+    if not extendsInterface(provides, interfaces.IWizard):
+        raise ConfigurationError("Provides interface must inherit IWizard.")
+
+    new_class = getDirectiveClass(
+        _context, class_, wizard.Wizard, name, permission, provides,
+        allowed_interface, allowed_attributes, kwargs)
+
+    # Register the interfaces.
+    _handle_for(_context, for_)
+
     # register pagelet
     _context.action(
         discriminator=('pagelet', for_, layer, name),
@@ -185,9 +330,6 @@ def wizardStepDirective(
         provides=interfaces.IStep, allowed_interface=None,
         allowed_attributes=None, **kwargs):
 
-    # Security map dictionary
-    required = {}
-
     # Get the permission; mainly to correctly handle CheckerPublic.
     permission = _handle_permission(_context, permission)
 
@@ -195,48 +337,84 @@ def wizardStepDirective(
     if not class_:
         raise ConfigurationError("Must specify a class.")
 
-    if not zope.interface.interfaces.IInterface.providedBy(provides):
-        raise ConfigurationError("Provides interface provide IInterface.")
+    _checkStepDirective(provides, wizard)
 
-    ifaces = list(zope.interface.Declaration(provides).flattened())
-    if interfaces.IPagelet not in ifaces:
-        raise ConfigurationError("Provides interface must inherit IPagelet.")
+    new_class = getDirectiveClass(
+        _context, class_, step.Step, name, permission, provides,
+        allowed_interface, allowed_attributes, kwargs)
 
-    if not interfaces.IWizard.implementedBy(wizard):
-        raise ConfigurationError("Provides interface must inherit IWizard.")
+    # Register the interfaces.
+    _handle_for(_context, for_)
 
-    # Build a new class that we can use different permission settings if we
-    # use the class more then once.
-    cdict = {}
-    cdict['__name__'] = name
-    cdict.update(kwargs)
-    new_class = type(class_.__name__, (class_, step.Step), cdict)
+    # register pagelet and record it in the step manifest
+    _context.action(
+        discriminator=('pagelet', for_, layer, name),
+        callable=registerWizardStep,
+        args=(new_class, for_, layer, wizard, provides, name, _context.info))
 
-    # Set up permission mapping for various accessible attributes
-    _handle_allowed_interface(
-        _context, allowed_interface, permission, required)
-    _handle_allowed_attributes(
-        _context, allowed_attributes, permission, required)
-    _handle_allowed_attributes(
-        _context, kwargs.keys(), permission, required)
-    _handle_allowed_attributes(
-        _context, ('__call__', 'browserDefault', 'update', 'render',
-                   'publishTraverse'), permission, required)
+
+def wizardStepsDirective(
+        _context, permission, steps=None, manifest=None,
+        for_=zope.interface.Interface, layer=IDefaultBrowserLayer,
+        wizard=interfaces.IWizard, provides=interfaces.IStep):
+
+    if steps is None and manifest is None:
+        raise ConfigurationError("Must specify steps or a manifest.")
+
+    _checkStepDirective(provides, wizard)
+
+    entries = []
+    if manifest is not None:
+        with open(manifest, encoding='utf-8') as f:
+            entries.extend(parseStepEntries(f.read()))
+    if steps is not None:
+        entries.extend(parseStepEntries(steps))
+
+    # Get the permission; mainly to correctly handle CheckerPublic.
+    permission = _handle_permission(_context, permission)
+
+    permissionField = zope.security.zcml.Permission()
+    factories = []
+    names = set()
+    for name, className, weight, stepPermission in entries:
+        if name in names:
+            raise ConfigurationError("Duplicate step %r." % name)
+        names.add(name)
+        if stepPermission is None:
+            stepPermission = permission
+        else:
+            # map and check the permission like the permission fields do
+            stepPermission = _handle_permission(
+                _context, permissionField.bind(_context).fromUnicode(
+                    stepPermission))
+        kwargs = {}
+        if weight is not None:
+            kwargs['weight'] = weight
+        new_class = getDirectiveClass(
+            _context, _context.resolve(className), step.Step, name,
+            stepPermission, provides, None, None, kwargs)
+        factories.append((name, new_class))
 
     # Register the interfaces.
     _handle_for(_context, for_)
 
-    # provide the custom provides interface if not allready provided
-    if not provides.implementedBy(new_class):
-        zope.interface.classImplements(new_class, provides)
-
-    # Create the security checker for the new class
-    zope.security.checker.defineChecker(
-        new_class, zope.security.checker.Checker(required))
+    # the steps conflict with other step registrations like the steps of
+    # single wizardStep directives
+    for name, factory in factories:
+        _context.action(discriminator=('pagelet', for_, layer, name))
 
-    # register pagelet
+    # register all steps within one action
     _context.action(
-        discriminator=('pagelet', for_, layer, name),
-        callable=zope.component.zcml.handler,
-        args=('registerAdapter',
-              new_class, (for_, layer, wizard), provides, name, _context.info))
+        discriminator=None,
+        callable=registerWizardSteps,
+        args=(factories, for_, layer, wizard, provides, _context.info))
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ModuleNotFoundError:  # pragma: no cover
+    pass
+else:
+    # the security checkers of the generated classes get cleaned up too
+    addCleanUp(_directiveClasses.clear)
+    del addCleanUp